@@ -1,30 +1,112 @@
 import os
 import re
 import sys
+import json
+import time
+import shutil
 import argparse
+import threading
 import subprocess
-from openai import OpenAI
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import nullcontext
+from runtime import ThreadBudget
+from image_io import CACHE_ENV_VAR
+from artefacts import MANIFEST_ENV_VAR, complete, verify_outputs
+from report import METRICS_ENV_VAR, load_metrics, relocate_figures, parse_prose, build_report, prose_request
+from tools import ToolBox
+from planner import build_plan, run_plan
+from checkpoint import Checkpoint, digest
+from memo import MemoStore
+from endpoints import EndpointPool
+from sandbox import GUARD_ENV_VAR, OUTPUTS_DIR
 
 # Some Api configs
 CONFIG = {
     'api_base': '',
     'api_key': '',
     'model': '',
+    'endpoints': [],
     'max_tokens': 8192,
     'error_limit': 5,
     'pyfile_limit': 12,
+    'cpu_budget': 0,
+    'image_cache': '.image_cache',
+    'auto_verify': True,
+    'run_timeout': None,
+    'report_engine': True,
+    'metrics_file': 'metrics.json',
+    'report_file': 'Analysis_Report.docx',
+    'tool_mode': False,
+    'tool_round_limit': 20,
+    'plan_mode': False,
+    'plan_workers': 4,
+    'cache_control': False,
+    'prompt_cache_key': False,
+    'candidates': 1,
+    'candidate_temperatures': [0.7, 0.3, 1.0],
+    'sandbox_dir': '.candidates',
+    'sandbox_copy_limit': 16 << 20,
+    'checkpoint': True,
+    'memo': True,
+    'memo_dir': '.memo_cache',
+    'rpm': None,
+    'tpm': None,
     'encoding': 'UTF-8'
 }
 
 class ScriptExecutor:
-    def __init__(self):
-        self.client = OpenAI(
-            base_url=CONFIG['api_base'],
-            api_key=CONFIG['api_key']
-        )
+    def __init__(self, endpoints=None):
+        self.endpoints = endpoints or EndpointPool.from_config(CONFIG)
         self.conversation = []
         self.N_py = 1
         self.kk = 0
+        self.budget = ThreadBudget(CONFIG['cpu_budget'] or None)
+        # Scripts that may run at the same time, each given its share of the budget
+        self.concurrent_scripts = 1
+        self.toolbox = ToolBox() if CONFIG['tool_mode'] else None
+        self.lock = threading.Lock()
+        self.checkpoint = Checkpoint() if CONFIG['checkpoint'] else None
+        self.memo = MemoStore(CONFIG['memo_dir']) if CONFIG['memo'] else None
+        # Shared caps on concurrent LLM calls and script runs, set by the mission daemon
+        self.llm_slots = nullcontext()
+        self.cpu_slots = nullcontext()
+
+    def system_message(self, code_str):
+        """Static instructions and the task description, identical for every request of a mission
+
+        Everything that changes between requests is appended after it, so
+        provider-side prompt caches can reuse the whole prefix.
+        """
+        content = "You write Python programs that carry out the image-analysis task described below. Follow these requirements in every program: (1) Output a complete and executable program, beginning with '```python\n' and ending with '```', tailored precisely to the task's requirements and avoiding sample programs. (2) Include print statements to display output results, aiding in subsequent tasks. (3) Check whether the program requires execution. If not, include the statement 'NO-RUN-PY' in your response. (4) To read input images as grayscale, prefer 'from image_io import read_gray' and 'gray = read_gray(path)', which returns a cached read-only numpy array. (5) At the end of a program that writes output files, call 'from artefacts import complete' and 'complete(list_of_output_file_paths)' so the agent can verify them. (6) Record the key numeric results and figures for the report with 'from report import record_metrics' and 'record_metrics({name: value}, figures=[(figure_path, caption)])'."
+        if self.toolbox:
+            content += " (7) Tools for vetted image operations are available: call them to carry out the task, and write a Python program only for capabilities the tools do not cover. When every task is complete, reply without any Python code."
+        content += " [Task Description]:" + code_str
+        if CONFIG['cache_control']:
+            # Explicit cache breakpoint for backends that take Anthropic-style hints
+            return {"role": "system", "content": [{"type": "text", "text": content, "cache_control": {"type": "ephemeral"}}]}
+        return {"role": "system", "content": content}
+
+    def state(self):
+        """Mission state stored with every checkpoint"""
+        return {'conversation': self.conversation, 'N_py': self.N_py, 'kk': self.kk}
+
+    def script_env(self, cwd=None):
+        """Environment for generated scripts: core budget and importable agent modules
+
+        A script run in a sandbox (cwd) records metrics to the sandbox's own copy.
+        """
+        budget = self.budget
+        if self.concurrent_scripts > 1:
+            budget = ThreadBudget(self.budget.total, processes=self.concurrent_scripts)
+        env = budget.env()
+        core_dir = os.path.dirname(os.path.abspath(__file__))
+        env['PYTHONPATH'] = os.pathsep.join(p for p in (core_dir, env.get('PYTHONPATH')) if p)
+        env[CACHE_ENV_VAR] = os.path.abspath(CONFIG['image_cache'])
+        if cwd is None:
+            env[METRICS_ENV_VAR] = os.path.abspath(CONFIG['metrics_file'])
+        else:
+            env[METRICS_ENV_VAR] = os.path.abspath(os.path.join(cwd, os.path.basename(CONFIG['metrics_file'])))
+        return env
 
     def get_file_names(self):
         """Get file names in current directory"""
@@ -43,38 +125,385 @@ class ScriptExecutor:
         """Check if code execution is not required"""
         return re.search(r'NO-RUN-PY', str1, re.DOTALL | re.IGNORECASE)
 
-    def execute_script(self, pystr):
-        """Execute Python script and return output and errors"""
-        filename = f"py{self.N_py}.py"
-        with open(filename, "w", encoding=CONFIG['encoding']) as f:
-            f.write(pystr)
+    @staticmethod
+    def run_command(str1):
+        """Extract the example command line arguments of the saved program from the task description"""
+        match = re.search(r'python\s+py\d+\.py((?:\s+-{1,2}[\w\-]+(?:=[^\s,;]*\w)?)*)', str1)
+        return match.group(1).split() if match else None
+
+    @staticmethod
+    def expected_outputs(str1):
+        """Output file globs named in the task description, keyed by a readable label"""
+        expected = {}
+        for suffix in re.findall(r'\{[^}]*\}([\w.\-]*\.(?:csv|txt|png|jpe?g|tiff?|npy))', str1, re.IGNORECASE):
+            expected[suffix] = ['*' + suffix.lower()]
+        verify = re.search(r'verify[^\n]*', str1, re.IGNORECASE)
+        kinds = {'csv': ['*.csv'], 'text file': ['*.txt'], 'image': ['*.png', '*.tif', '*.tiff', '*.jpg']}
+        named = [g for globs in expected.values() for g in globs]
+        for word, globs in kinds.items():
+            if verify and word in verify.group(0).lower() and not any(
+                    n.endswith(g[1:]) for n in named for g in globs):
+                expected[word] = globs
+        return expected
+
+    @staticmethod
+    def output_roots(str1):
+        """Current directory plus the output path given in the task description"""
+        match = re.search(r'\[Files output path\]:\s*"([^"]*)"', str1)
+        roots = ['.']
+        if match and match.group(1).strip() and os.path.isdir(match.group(1).strip()):
+            roots.append(match.group(1).strip())
+        return roots
+
+    def run_and_verify(self, filename, args, code_str, cwd=None, cancel=None, extra_env=None):
+        """Run a saved program, wait for it to exit and check its outputs against the task description"""
+        manifest_path = os.path.abspath(os.path.join(cwd or '.', f"{os.path.splitext(filename)[0]}.manifest.json"))
+        if os.path.exists(manifest_path):
+            os.remove(manifest_path)
+        started = time.time()
+        extra_env = dict(extra_env or {}, **{MANIFEST_ENV_VAR: manifest_path})
+        output, error = self.execute_script(None, args, filename, extra_env, cwd, cancel)
+        if error:
+            return output, error
+
+        roots = [cwd or '.'] + self.output_roots(code_str)[1:]
+        missing = verify_outputs(self.expected_outputs(code_str), manifest_path, roots, started - 1)
+        if missing:
+            return output, f"{filename} finished but these expected output files were not found: {', '.join(missing)}"
+        return output + "\nCalculation successful", ""
+
+    def execute_script(self, pystr, args=(), filename=None, extra_env=None, cwd=None, cancel=None):
+        """Execute Python script and return output and errors
+
+        cwd runs it in another directory (a candidate sandbox, without the
+        execution memo); setting the cancel event kills it.
+        """
+        filename = filename or f"py{self.N_py}.py"
+        path = os.path.join(cwd or '.', filename)
+        if pystr is not None:
+            with open(path, "w", encoding=CONFIG['encoding']) as f:
+                f.write(pystr)
+
+        manifest_path = (extra_env or {}).get(MANIFEST_ENV_VAR)
+        recorded = self.checkpoint.result(path, args, cwd) if self.checkpoint else None
+        if recorded is not None:
+            print(f'##### {filename} replayed from checkpoint {self.checkpoint.run_id}')
+            if manifest_path and recorded['manifest'] is not None:
+                with open(manifest_path, "w", encoding='utf-8') as f:
+                    json.dump(recorded['manifest'], f, indent=1)
+            return recorded['output'], recorded['error']
+
+        memo_key = self.memo.key(filename, args) if self.memo and cwd is None else None
+        entry = self.memo.lookup(memo_key) if memo_key else None
+        if entry is not None:
+            print(f'##### {filename} satisfied from the execution memo')
+            output = entry['stdout']
+            if manifest_path and entry.get('completed') is not None:
+                # Rebuild the completion manifest from the restored outputs rather than replaying the stored one
+                complete(entry['completed'], manifest_path)
+            if self.checkpoint:
+                self.checkpoint.record_run(path, args, output, "", self.read_manifest(manifest_path), cwd, **self.state())
+            return output, ""
+
+        env = self.script_env(cwd)
+        env.update(extra_env or {})
+        command = ["python", filename, *args]
+        if cwd is not None:
+            # Entries linked into the sandbox are copied in before the script changes them
+            command = ["python", os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sandbox.py'), filename, *args]
+        if memo_key:
+            command, memo_env, trace_path = self.memo.command(filename, args, [CONFIG['image_cache']])
+            env.update(memo_env)
+        with self.cpu_slots:
+            process = subprocess.Popen(
+                command,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                text=True,
+                env=env,
+                cwd=cwd
+            )
+            if cancel is not None:
+                threading.Thread(target=self.kill_on, args=(cancel, process), daemon=True).start()
+            try:
+                output, error = process.communicate(timeout=CONFIG['run_timeout'])
+            except subprocess.TimeoutExpired:
+                process.kill()
+                output, error = process.communicate()
+                error += f"\n{filename} did not finish within {CONFIG['run_timeout']} s"
+        if process.returncode and not error:
+            error = f"{filename} exited with code {process.returncode}"
+        if memo_key and os.path.exists(trace_path):
+            if error:
+                os.remove(trace_path)
+            else:
+                self.memo.record(memo_key, trace_path, output, manifest_path)
+
+        if self.checkpoint:
+            self.checkpoint.record_run(path, args, output, error, self.read_manifest(manifest_path), cwd, **self.state())
+        return output, error
 
-        process = subprocess.Popen(
-            ["python", filename],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True
-        )
-        return process.communicate()
+    @staticmethod
+    def read_manifest(manifest_path):
+        """Completion manifest a run wrote, or None"""
+        if not manifest_path or not os.path.exists(manifest_path):
+            return None
+        with open(manifest_path, encoding='utf-8') as f:
+            return json.load(f)
+
+    @staticmethod
+    def kill_on(cancel, process):
+        cancel.wait()
+        if process.poll() is None:
+            process.kill()
+
+    def report_wanted(self, code_str):
+        """Check if the built-in report engine can write the requested Word report"""
+        return (CONFIG['report_engine'] and re.search(r'Word document', code_str, re.IGNORECASE)
+                and load_metrics(CONFIG['metrics_file'])['metrics'])
+
+    def write_report(self, code_str):
+        """Ask the LLM for the report prose only and assemble the Word document from the metrics manifest"""
+        manifest = load_metrics(CONFIG['metrics_file'])
+        self.conversation.append({"role": "user", "content": prose_request(manifest)})
+        str1 = self.call_gpt_api(self.conversation)
+
+        print('##### report prose:\n', str1)
+        self.conversation.append({"role": "assistant", "content": str1})
+
+        prose = parse_prose(str1)
+        if prose is None:
+            return None
+        return build_report(prose, CONFIG['report_file'], manifest)
+
+    def run_tool_calls(self, messages, answer):
+        """Execute the tool calls of an assistant answer in-process and append their results"""
+        messages.append({
+            "role": "assistant",
+            "content": answer['content'],
+            "tool_calls": [{"id": call['id'], "type": "function",
+                            "function": {"name": call['name'], "arguments": call['arguments']}}
+                           for call in answer['tool_calls']]
+        })
+        for call in answer['tool_calls']:
+            result = self.toolbox.call(call['name'], call['arguments'])
+            print(f'##### tool {call["name"]}({call["arguments"]}):\n', result)
+            messages.append({"role": "tool", "tool_call_id": call['id'], "content": result})
+
+    def chat_completion(self, messages, temperature=0.7, variant=None, **tools):
+        """One chat completion as {'content', 'tool_calls'}, replayed from the checkpoint when recorded"""
+        answer = self.checkpoint.answer(CONFIG['model'], messages, variant) if self.checkpoint else None
+        if answer is not None:
+            return answer
+
+        if CONFIG['prompt_cache_key'] and messages and messages[0]['role'] == 'system':
+            # Route requests sharing the mission prefix to the same cache
+            tools['extra_body'] = {'prompt_cache_key': digest(messages[0]['content'])[:32]}
+
+        with self.llm_slots:
+            response = self.endpoints.complete(
+                messages,
+                max_tokens=CONFIG['max_tokens'],
+                temperature=temperature,
+                stream=False,
+                **tools
+            )
+        message = response.choices[0].message
+        answer = {
+            'content': message.content or "",
+            'tool_calls': [{'id': call.id, 'name': call.function.name, 'arguments': call.function.arguments}
+                           for call in getattr(message, 'tool_calls', None) or []]
+        }
+        if self.checkpoint:
+            self.checkpoint.record_answer(CONFIG['model'], messages, answer, variant, **self.state())
+        return answer
 
-    def call_gpt_api(self, messages):
+    def call_gpt_api(self, messages, temperature=0.7, variant=None):
         """Call LLM API"""
-        response = self.client.chat.completions.create(
-            model=CONFIG['model'],
-            messages=messages,
-            max_tokens=CONFIG['max_tokens'],
-            temperature=0.7,
-            stream=False
-        )
-        return response.choices[0].message.content
-
-    def error_check(self, error):
+        tools = {'tools': self.toolbox.schemas()} if self.toolbox else {}
+        for n_round in range(1, CONFIG['tool_round_limit'] + 1):
+            if tools and n_round == CONFIG['tool_round_limit']:
+                # Last round: the model has to give its final reply without calling tools
+                tools['tool_choice'] = 'none'
+            answer = self.chat_completion(messages, temperature, variant, **tools)
+            if not answer['tool_calls']:
+                break
+            if n_round == CONFIG['tool_round_limit']:
+                print(f"Tool round limit ({CONFIG['tool_round_limit']}) reached; ignoring the calls of the last answer")
+                break
+            self.run_tool_calls(messages, answer)
+        return answer['content']
+
+    @staticmethod
+    def sandbox_outputs(sandbox, roots):
+        """Private folder inside a sandbox for each shared output folder given by absolute path"""
+        return {root: os.path.join(os.path.abspath(sandbox), OUTPUTS_DIR, str(k))
+                for k, root in enumerate(r for r in roots if os.path.isabs(r))}
+
+    @staticmethod
+    def redirect_outputs(text, outputs):
+        """Point the shared output paths in a program or task description at a candidate's own folders"""
+        for shared, private in outputs.items():
+            shared = shared.rstrip('/\\')
+            variants = {shared, shared.replace('\\', '/'), shared.replace('/', '\\'),
+                        shared.replace('\\', '\\\\'), shared.replace('/', '\\\\')}
+            for variant in sorted(variants, key=len, reverse=True):
+                # Not a prefix of a longer name such as <shared>2
+                text = re.sub(re.escape(variant) + r'(?![\w.-])', lambda m: private.replace(os.sep, '/'), text)
+        return text
+
+    def make_sandbox(self, sandbox, outputs=None):
+        """Candidate directory holding copies of the working directory's files
+
+        Large files and folders are linked instead of copied; the candidate runs
+        under sandbox.py, which copies a linked entry in before changing it.
+        The metrics manifest is always copied, as each candidate records its own.
+        Each shared output folder gets a private folder of links to its entries.
+        """
+        os.makedirs(sandbox)
+        for shared, private in (outputs or {}).items():
+            os.makedirs(private)
+            for name in os.listdir(shared):
+                try:
+                    os.symlink(os.path.abspath(os.path.join(shared, name)), os.path.join(private, name))
+                except OSError:
+                    pass
+        for name in os.listdir('.'):
+            if name.startswith('.'):
+                continue
+            if os.path.isfile(name) and os.path.getsize(name) <= CONFIG['sandbox_copy_limit']:
+                shutil.copy2(name, os.path.join(sandbox, name))
+            else:
+                try:
+                    os.symlink(os.path.abspath(name), os.path.join(sandbox, name))
+                except OSError:
+                    # Symlinks may need extra privileges on Windows
+                    pass
+        metrics = os.path.join(sandbox, os.path.basename(CONFIG['metrics_file']))
+        if os.path.isfile(CONFIG['metrics_file']):
+            if os.path.lexists(metrics):
+                os.remove(metrics)
+            shutil.copy2(CONFIG['metrics_file'], metrics)
+        return sandbox
+
+    def adopt_sandbox(self, sandbox, target='.', outputs=None):
+        """Move the files a winning candidate created or changed into the working directory
+
+        Entries still linked were never written. Folders the candidate made
+        private are adopted file by file, its private output folders go to the
+        shared ones, and the winner's metrics replace the working directory's,
+        with figure paths moved out of the sandbox.
+        """
+        for name in os.listdir(sandbox):
+            path = os.path.join(sandbox, name)
+            dest = os.path.join(target, name)
+            if os.path.islink(path) or (target == '.' and name == OUTPUTS_DIR):
+                continue
+            if target == '.' and name == os.path.basename(CONFIG['metrics_file']):
+                dest = CONFIG['metrics_file']
+            if os.path.isdir(path):
+                if os.path.isdir(dest):
+                    self.adopt_sandbox(path, dest)
+                elif not os.path.exists(dest):
+                    shutil.move(path, dest)
+            elif not os.path.exists(dest) or os.stat(dest).st_mtime_ns != os.stat(path).st_mtime_ns:
+                os.replace(path, dest)
+        for shared, private in (outputs or {}).items():
+            self.adopt_sandbox(private, shared)
+        if target == '.' and os.path.exists(CONFIG['metrics_file']):
+            for shared, private in (outputs or {}).items():
+                relocate_figures(private, shared, CONFIG['metrics_file'])
+            relocate_figures(sandbox, '.', CONFIG['metrics_file'])
+
+    def race_candidates(self, args=(), code_str=None):
+        """Ask for several corrected programs at once and keep the first that runs (and verifies) cleanly
+
+        Candidates use varied temperatures and run in parallel sandboxes, each
+        writing to its own copies of the output folders and sharing the core
+        budget; once one succeeds the others are killed and their answers
+        discarded. A candidate that raises (API error, sandbox set-up) counts
+        as failed.
+        """
+        n = CONFIG['candidates']
+        temperatures = CONFIG['candidate_temperatures']
+        filename = f"py{self.N_py}.py"
+        sandboxes = os.path.join(CONFIG['sandbox_dir'], f"py{self.N_py}")
+        shutil.rmtree(sandboxes, ignore_errors=True)
+        cancel = threading.Event()
+        task = code_str or (self.conversation[0]['content'] if self.conversation else '')
+        shared = self.output_roots(task)[1:]
+
+        def attempt(i):
+            str1 = self.call_gpt_api(list(self.conversation), temperatures[i % len(temperatures)], i)
+            str_py1 = self.pystr_extract(str1)
+            if str_py1 == "No Python code found." or cancel.is_set():
+                return str1, None, None
+            sandbox = os.path.join(sandboxes, str(i))
+            outputs = self.sandbox_outputs(sandbox, shared)
+            self.make_sandbox(sandbox, outputs)
+            with open(os.path.join(sandbox, filename), "w", encoding=CONFIG['encoding']) as f:
+                f.write(self.redirect_outputs(str_py1, outputs))
+            guard = {GUARD_ENV_VAR: os.pathsep.join(os.path.abspath(p) for p in outputs)}
+            if code_str:
+                output, error = self.run_and_verify(filename, args, self.redirect_outputs(code_str, outputs),
+                                                    sandbox, cancel, guard)
+            else:
+                output, error = self.execute_script(None, args, filename, guard, sandbox, cancel)
+            return str1, sandbox, error
+
+        pool = ThreadPoolExecutor(max_workers=n)
+        results, failures = [], []
+        concurrent, self.concurrent_scripts = self.concurrent_scripts, n
+        try:
+            for future in as_completed([pool.submit(attempt, i) for i in range(n)]):
+                try:
+                    str1, sandbox, error = future.result()
+                except Exception as e:
+                    print(f'##### candidate failed: {e!r}')
+                    failures.append(e)
+                    continue
+                results.append((str1, sandbox, error))
+                if sandbox and not error:
+                    break
+        finally:
+            cancel.set()
+            pool.shutdown(wait=False, cancel_futures=True)
+            self.concurrent_scripts = concurrent
+        if not results:
+            raise failures[0]
+
+        str1, sandbox, error = results[-1]
+        if not sandbox or error:
+            # No winner: continue the conversation from the first candidate that answered
+            str1, sandbox, error = next((r for r in results if r[1]), results[0])
+        print(f'##### correction ({len(results)} of {n} candidates finished):\n', str1)
+        self.conversation.append({"role": "assistant", "content": str1})
+        if sandbox is None:
+            print('Mission complete.')
+            sys.exit()
+        if not error:
+            self.adopt_sandbox(sandbox, outputs=self.sandbox_outputs(sandbox, shared))
+            shutil.rmtree(sandboxes, ignore_errors=True)
+        return error
+
+    def error_check(self, error, args=(), code_str=None):
         """Handle execution errors"""
         k_error = 0
         while error and k_error < CONFIG['error_limit']:
             print(f"Error: {error}")
             Str_header = f"The previous program contained errors. [Error Details: {error}] Please rectify these issues and submit a corrected, complete, and executable program precisely tailored to the subtask requirements."
             
+            if CONFIG['candidates'] > 1:
+                self.conversation.append({"role": "user", "content": Str_header})
+                print(f'Begin to race {CONFIG["candidates"]} candidate programs {k_error}')
+                error = self.race_candidates(args, code_str)
+                self.N_py += 1
+                if self.N_py > CONFIG['pyfile_limit']:
+                    print('Mission failed.')
+                    sys.exit(1)
+                k_error += 1
+                continue
+
             self.conversation.append({"role": "user", "content": Str_header})
             str1 = self.call_gpt_api(self.conversation)
             
@@ -87,31 +516,158 @@ class ScriptExecutor:
                 sys.exit()
 
             print(f'Begin to execute Python {k_error}')
-            output, error = self.execute_script(str_py1)
+            if code_str:
+                # A fix of a saved program has to pass the same output check
+                filename = f"py{self.N_py}.py"
+                with open(filename, "w", encoding=CONFIG['encoding']) as f:
+                    f.write(str_py1)
+                output, error = self.run_and_verify(filename, args, code_str)
+            else:
+                output, error = self.execute_script(str_py1, args)
             print(error, k_error, self.N_py)
             
             self.N_py += 1
             if self.N_py > CONFIG['pyfile_limit']:
                 print('Mission failed.')
-                sys.exit()
+                sys.exit(1)
             
             k_error += 1
 
         return error
 
+    def claim_script_name(self):
+        """Reserve the next pyN.py file name (safe across concurrent plan nodes)"""
+        with self.lock:
+            if self.N_py > CONFIG['pyfile_limit']:
+                raise RuntimeError('Program file limit reached')
+            filename = f"py{self.N_py}.py"
+            self.N_py += 1
+        return filename
+
+    def ask(self, conversation, content):
+        """Send a user message on a conversation branch and record the answer"""
+        conversation.append({"role": "user", "content": content})
+        str1 = self.call_gpt_api(conversation)
+        print('##### answer:\n', str1)
+        conversation.append({"role": "assistant", "content": str1})
+        return str1
+
+    def save_script(self, str_py1):
+        filename = self.claim_script_name()
+        with open(filename, "w", encoding=CONFIG['encoding']) as f:
+            f.write(str_py1)
+        return filename
+
+    def run_node(self, node, dep_results, code_str):
+        """Carry out one plan node on its own conversation branch"""
+        prior = ' '.join(f"[{d} output]: {r['output']}" for d, r in dep_results.items()) or 'none'
+
+        if node.kind == 'verify':
+            program = next((r for r in dep_results.values() if r.get('script')), None)
+            if program is None:
+                raise RuntimeError(f"{node.id}: no saved program to run")
+            script, conversation = program['script'], program['conversation']
+            args = self.run_command(code_str) or []
+            for k_error in range(CONFIG['error_limit'] + 1):
+                output, error = self.run_and_verify(script, args, code_str)
+                if not error:
+                    return {'output': output, 'script': script}
+                print(f"Error: {error}")
+                if k_error == CONFIG['error_limit']:
+                    break
+                str1 = self.ask(conversation, f"The previous program contained errors. [Error Details: {error}] Please rectify these issues and submit a corrected, complete, and executable program precisely tailored to the subtask requirements.")
+                str_py1 = self.pystr_extract(str1)
+                if str_py1 == "No Python code found.":
+                    break
+                script = self.save_script(str_py1)
+            raise RuntimeError(f"{node.id} failed: {error}")
+
+        conversation = [self.system_message(code_str)]
+        if node.kind in ('draft', 'report'):
+            draft = dep_results.get('draft', {}).get('prose')
+            sections = ['Abstract', 'Introduction', 'Methods'] if node.kind == 'draft' else (['Results'] if draft else None)
+            manifest = load_metrics(CONFIG['metrics_file'])
+            str1 = self.ask(conversation, prose_request(manifest, sections=sections) + f" [Outputs of previous subtasks]: {prior}")
+            prose = parse_prose(str1, sections)
+            if prose is None:
+                raise RuntimeError(f"{node.id}: the report prose could not be parsed")
+            if node.kind == 'draft':
+                return {'output': 'Report prose drafted', 'prose': prose, 'conversation': conversation}
+            prose = dict(prose, **{k: v for k, v in (draft or {}).items() if k != 'Results'})
+            path = build_report(prose, CONFIG['report_file'], manifest)
+            return {'output': f"Report written to {path}", 'conversation': conversation}
+
+        Str_header = "You are writing the program for one subtask of the task description; other subtasks are handled separately and may run at the same time. Output one program for this subtask only; if the subtask asks to save the program without executing it, include the statement 'NO-RUN-PY' in your response. [Subtask]:"
+        str1 = self.ask(conversation, Str_header + node.text + " [Outputs of prerequisite subtasks]: " + prior)
+        for k_error in range(CONFIG['error_limit'] + 1):
+            str_py1 = self.pystr_extract(str1)
+            if str_py1 == "No Python code found.":
+                return {'output': str1, 'conversation': conversation}
+            if self.pynotrun_check(str1):
+                script = self.save_script(str_py1)
+                return {'output': f"Program saved as {script}", 'script': script, 'conversation': conversation}
+            output, error = self.execute_script(str_py1, filename=self.claim_script_name())
+            if not error:
+                return {'output': output, 'conversation': conversation}
+            print(f"Error: {error}")
+            if k_error == CONFIG['error_limit']:
+                break
+            str1 = self.ask(conversation, f"The previous program contained errors. [Error Details: {error}] Please rectify these issues and submit a corrected, complete, and executable program precisely tailored to the subtask requirements.")
+        raise RuntimeError(f"{node.id} failed: {error}")
+
+    def process_plan(self, code_str):
+        """Process main task as a dependency graph, running independent subtasks concurrently"""
+        print('Mission Start')
+        plan = build_plan(code_str, CONFIG['auto_verify'], CONFIG['report_engine'])
+        print('Mission plan:', list(plan.values()))
+        self.concurrent_scripts = max(1, min(CONFIG['plan_workers'], len(plan)))
+        try:
+            results = run_plan(plan, lambda node, deps: self.run_node(node, deps, code_str), CONFIG['plan_workers'])
+        except RuntimeError as e:
+            print(e)
+            print('Mission failed.')
+            return False
+
+        for node_id in plan:
+            self.conversation += results[node_id].get('conversation', [])
+            print(f'Step {node_id} is finished: {results[node_id]["output"]}')
+        print('Mission Complete')
+        return True
+
     def process_task(self, code_str):
         """Process main task"""
         print('Mission Start')
         output = ""
         files_str = ""
+        report_path = None
+        task = self.checkpoint.state['task'] if self.checkpoint else None
+        if task:
+            # Restart the last step begun with the inputs its prompt was built from;
+            # the directory listing now would include files of later steps
+            self.conversation = list(task['conversation'])
+            self.N_py, self.kk = task['N_py'], task['kk']
+            output, files_str, report_path = task['output'], task['files_str'], task['report_path']
+            print(f'Resuming at step {self.kk + 1}')
         
         while True:
+            if self.kk > 0 and not report_path and self.report_wanted(code_str):
+                report_path = self.write_report(code_str)
+                if report_path:
+                    print(f'Report written to {report_path}')
+                    output += f" The agent has already generated the Word report {report_path} from the recorded metrics and figures, so the report step is complete and needs no program."
+                    files_str = self.get_file_names()
+
+            if self.checkpoint:
+                self.checkpoint.save(task={'conversation': list(self.conversation), 'N_py': self.N_py, 'kk': self.kk,
+                                           'output': output, 'files_str': files_str, 'report_path': report_path})
+
+            if not self.conversation:
+                self.conversation.append(self.system_message(code_str))
             if self.kk > 0:
-                Str_header = "Start writing the second or third program, or skip if all tasks have been completed. Follow these requirements: (1) Output a complete and executable program strictly adhering to the task instructions, avoiding sample programs. (2) Consider the output of the previous step and the file names in the current directory, as they may result from the previous program and could be utilized in writing the current program. [Previous Step Output]:"
-                CONTENT = Str_header + output + ".[Current directory file names]:" + files_str + ". [previous Task Description]:" + code_str
+                Str_header = "Start writing the second or third program, or skip if all tasks have been completed. Consider the output of the previous step and the file names in the current directory, as they may result from the previous program and could be utilized in writing the current program. [Previous Step Output]:"
+                CONTENT = Str_header + output + ". [Current directory file names]:" + files_str
             else:
-                Str_header = "Please carefully review the task description below. You will need to create two to three Python programs. Start by crafting the first Python program to meet the following criteria: (1) Ensure the program is complete and executable, tailored precisely to the task's requirements. (2) Include print statements to display output results, aiding in subsequent tasks. Keep this in mind. (3) Begin your Python code with '```python\n' and end with '```'. (4) Check whether the program requires execution. If not, include the statement 'NO-RUN-PY' in your response.[Task Description]:"
-                CONTENT = Str_header + code_str
+                CONTENT = "Please carefully review the task description. You will need to create two to three Python programs. Start by crafting the first Python program."
 
             self.conversation.append({"role": "user", "content": CONTENT})
             str1 = self.call_gpt_api(self.conversation)
@@ -129,6 +685,14 @@ class ScriptExecutor:
                     f.write(str_py1)
                 output = " "
                 files_str = " "
+                args = self.run_command(code_str)
+                if CONFIG['auto_verify'] and args is not None:
+                    print('Begin to run and verify Python')
+                    output, error = self.run_and_verify(f"py{self.N_py}.py", args, code_str)
+                    error = self.error_check(error, args, code_str)
+                    if error:
+                        continue
+                    output = f"The agent has already run the saved program with arguments '{' '.join(args)}' and verified its output files, so the run-and-verify step is complete and needs no program. [Program output]: {output}"
             else:
                 print('Begin to execute Python')
                 output, error = self.execute_script(str_py1)
@@ -139,27 +703,44 @@ class ScriptExecutor:
             self.N_py += 1
             if self.N_py > CONFIG['pyfile_limit']:
                 print('Mission failed.')
-                break
+                return False
 
             files_str = self.get_file_names()
             print(f'Step {self.kk+1} is finished')
             self.kk += 1
 
         print('Mission Complete')
+        return True
 
 def main():
     parser = argparse.ArgumentParser(description='Process some file.')
     parser.add_argument('-s', metavar='filename', type=str, help='the name of the file or string to process')
+    parser.add_argument('--resume', metavar='run', type=str, help='resume the checkpointed run with this id')
     args = parser.parse_args()
     
-    if args.s.endswith(".txt") and ' ' not in args.s:
+    executor = ScriptExecutor()
+    if args.resume:
+        executor.checkpoint = Checkpoint.load(args.resume)
+        print(f'Resuming run {args.resume}: {len(executor.checkpoint.state["api"])} API calls and '
+              f'{len(executor.checkpoint.state["runs"])} script runs recorded')
+
+    if args.s is None:
+        if executor.checkpoint is None or executor.checkpoint.state['code_str'] is None:
+            parser.error('-s is required unless --resume names a run')
+        code_str = executor.checkpoint.state['code_str']
+    elif args.s.endswith(".txt") and ' ' not in args.s:
         with open(args.s, "r", encoding=CONFIG['encoding']) as file:
             code_str = file.read()
     else:
         code_str = args.s
 
-    executor = ScriptExecutor()
-    executor.process_task(code_str)
+    if executor.checkpoint:
+        executor.checkpoint.save(code_str=code_str)
+        print(f'Checkpointing run {executor.checkpoint.run_id} to {executor.checkpoint.path}')
+    if CONFIG['plan_mode']:
+        executor.process_plan(code_str)
+    else:
+        executor.process_task(code_str)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
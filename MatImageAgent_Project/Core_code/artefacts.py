@@ -0,0 +1,216 @@
+import os
+import csv
+import json
+import time
+import fnmatch
+import threading
+import numpy as np
+from PIL import Image
+from concurrent.futures import ThreadPoolExecutor
+
+import image_io
+
+# Completion manifest path handed to a generated script by the agent
+MANIFEST_ENV_VAR = 'MATIMAGE_COMPLETION_MANIFEST'
+
+ARTEFACT_CONFIG = {
+    'workers': 4,
+    'max_pending': 16,
+    'manifest': 'manifest.json'
+}
+
+
+def temp_path(path):
+    """Sibling temporary name that keeps the extension, so encoders pick the right format"""
+    root, ext = os.path.splitext(path)
+    return f"{root}.part{threading.get_ident()}{ext}"
+
+
+class ArtefactWriter:
+    """Write-behind artefact writer with a bounded background thread pool
+
+    Each write goes to a temporary sibling file and is renamed into place when
+    complete, so readers never see partial files. flush() is the barrier at the
+    end of a step: it waits for every pending write and updates the manifest.
+    """
+
+    def __init__(self, output_dir, workers=None, max_pending=None, manifest=None):
+        self.output_dir = output_dir
+        self.pool = ThreadPoolExecutor(max_workers=workers or ARTEFACT_CONFIG['workers'])
+        self.slots = threading.BoundedSemaphore(max_pending or ARTEFACT_CONFIG['max_pending'])
+        self.manifest_path = os.path.join(output_dir, manifest or ARTEFACT_CONFIG['manifest'])
+        self.pending = []
+        self.entries = {}
+        self.step = None
+        os.makedirs(output_dir, exist_ok=True)
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, encoding='utf-8') as f:
+                self.entries = {e['path']: e for e in json.load(f)['files']}
+
+    def _run(self, path, write, args, step):
+        tmp = temp_path(path)
+        try:
+            write(tmp, *args)
+            os.replace(tmp, path)
+            return {
+                'path': os.path.relpath(path, self.output_dir),
+                'size': os.path.getsize(path),
+                'sha1': image_io.file_hash(path),
+                'step': step,
+                'time': time.time()
+            }
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            self.slots.release()
+
+    def submit(self, name, write, *args):
+        """Queue write(tmp_path, *args) for output_dir/name; blocks while the queue is full"""
+        path = os.path.join(self.output_dir, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.slots.acquire()
+        future = self.pool.submit(self._run, path, write, args, self.step)
+        self.pending.append(future)
+        return future
+
+    def write_bytes(self, name, data):
+        return self.submit(name, _write_bytes, data)
+
+    def write_text(self, name, text, encoding='utf-8'):
+        return self.submit(name, _write_bytes, text.encode(encoding))
+
+    def write_csv(self, name, rows, header=None):
+        return self.submit(name, _write_csv, rows, header)
+
+    def save_array(self, name, array):
+        return self.submit(name, _save_array, array)
+
+    def save_image(self, name, array):
+        return self.submit(name, _save_image, array)
+
+    def save_mask(self, name, mask, colors=None):
+        return self.submit(name, lambda path: image_io.save_mask(mask, path, colors))
+
+    def save_figure(self, name, fig, **savefig_kwargs):
+        return self.submit(name, lambda path: fig.savefig(path, **savefig_kwargs))
+
+    def begin_step(self, step):
+        """Tag the following writes with a step name"""
+        self.step = step
+
+    def flush(self):
+        """Barrier: wait for all pending writes, record them in the manifest and return their entries"""
+        done, errors = [], []
+        for future in self.pending:
+            try:
+                done.append(future.result())
+            except Exception as e:
+                errors.append(e)
+        self.pending = []
+        for entry in done:
+            self.entries[entry['path']] = entry
+        self._write_manifest()
+        if errors:
+            raise errors[0]
+        return done
+
+    def _write_manifest(self):
+        tmp = temp_path(self.manifest_path)
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'files': list(self.entries.values())}, f, indent=1)
+        os.replace(tmp, self.manifest_path)
+        if os.environ.get(MANIFEST_ENV_VAR):
+            complete([os.path.join(self.output_dir, p) for p in self.entries])
+
+    def close(self):
+        try:
+            return self.flush()
+        finally:
+            self.pool.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _write_bytes(path, data):
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def _write_csv(path, rows, header):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        if header:
+            writer.writerow(header)
+        writer.writerows(rows)
+
+
+def _save_array(path, array):
+    with open(path, 'wb') as f:
+        np.save(f, array)
+
+
+def _save_image(path, array):
+    Image.fromarray(np.asarray(array)).save(path)
+
+
+def complete(paths, manifest_path=None):
+    """Write the completion manifest (files, sizes, checksums) the agent verifies against
+
+    Paths are stored relative to the manifest's folder, the folder the script
+    runs in, so the manifest stays valid wherever that folder is restored.
+    """
+    manifest_path = manifest_path or os.environ.get(MANIFEST_ENV_VAR)
+    if not manifest_path:
+        return None
+    base = os.path.dirname(os.path.abspath(manifest_path))
+    files = [{'path': os.path.relpath(os.path.abspath(p), base), 'size': os.path.getsize(p),
+              'sha1': image_io.file_hash(p)}
+             for p in paths if os.path.isfile(p)]
+    tmp = temp_path(manifest_path)
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump({'status': 'complete', 'time': time.time(), 'files': files}, f, indent=1)
+    os.replace(tmp, manifest_path)
+    return manifest_path
+
+
+def manifest_files(manifest_path):
+    """Files of a completion manifest that still exist with the recorded size and checksum"""
+    if not manifest_path or not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path, encoding='utf-8') as f:
+        manifest = json.load(f)
+    base = os.path.dirname(os.path.abspath(manifest_path))
+    paths = [(os.path.join(base, e['path']), e) for e in manifest['files']]
+    return [p for p, e in paths
+            if os.path.isfile(p) and os.path.getsize(p) == e['size'] and image_io.file_hash(p) == e['sha1']]
+
+
+def recent_files(roots, since):
+    """Files under roots modified at or after since"""
+    found = []
+    for root in roots:
+        for dirpath, _, filenames in os.walk(root):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                if os.path.getmtime(path) >= since:
+                    found.append(path)
+    return found
+
+
+def verify_outputs(expected, manifest_path=None, roots=('.',), since=0):
+    """Return the labels of expected outputs that were not produced
+
+    expected maps a label to a list of filename globs. The completion manifest
+    is used when the script wrote one; otherwise files under roots modified
+    since the script started are checked.
+    """
+    files = manifest_files(manifest_path)
+    if files is None:
+        files = recent_files(roots, since)
+    names = [os.path.basename(p).lower() for p in files]
+    return [label for label, globs in expected.items()
+            if not any(fnmatch.fnmatch(n, g) for n in names for g in globs)]
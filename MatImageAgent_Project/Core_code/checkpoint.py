@@ -0,0 +1,94 @@
+import os
+import json
+import time
+import hashlib
+import threading
+
+from artefacts import temp_path
+
+CHECKPOINT_CONFIG = {
+    'dir': '.runs',
+    'file': 'checkpoint.json'
+}
+
+
+def digest(*parts):
+    """sha1 of JSON-serialisable parts"""
+    text = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def script_hash(filename):
+    with open(filename, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+class Checkpoint:
+    """Durable mission state, rewritten atomically after every API call and script run
+
+    Besides the current conversation, counters, script hashes and output
+    manifests, it keeps every LLM answer keyed by its request and every script
+    result keyed by its code and arguments, and a snapshot ('task') taken at
+    the start of every step of the mission loop. A resumed mission restarts at
+    the last step it began, with that step's conversation, counters and prompt
+    inputs, so its requests are the recorded ones: their answers and runs are
+    returned without calling the API or re-running the script. Script runs are
+    only replayed by a loaded (resumed) checkpoint and only in the folder they
+    ran in; a fresh run always executes its scripts.
+    """
+
+    def __init__(self, run_id=None, root=None):
+        self.run_id = run_id or time.strftime('%Y%m%d-%H%M%S')
+        self.path = os.path.join(root or CHECKPOINT_CONFIG['dir'], self.run_id, CHECKPOINT_CONFIG['file'])
+        self.lock = threading.RLock()
+        self.state = {'run_id': self.run_id, 'code_str': None, 'conversation': [], 'N_py': 1, 'kk': 0,
+                      'task': None, 'scripts': {}, 'manifests': {}, 'api': {}, 'runs': {}}
+        self.resumed = False
+
+    @classmethod
+    def load(cls, run_id, root=None):
+        checkpoint = cls(run_id, root)
+        if not os.path.exists(checkpoint.path):
+            raise FileNotFoundError(f"No checkpoint for run {run_id} at {checkpoint.path}")
+        with open(checkpoint.path, encoding='utf-8') as f:
+            checkpoint.state.update(json.load(f))
+        checkpoint.resumed = True
+        return checkpoint
+
+    def save(self, **fields):
+        """Update fields and write the whole state to disk"""
+        with self.lock:
+            self.state.update(fields)
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp = temp_path(self.path)
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(self.state, f, ensure_ascii=False, default=str)
+            os.replace(tmp, self.path)
+
+    def answer(self, model, messages, variant=None):
+        """Recorded answer; variant tells apart parallel samples of the same request"""
+        return self.state['api'].get(digest(model, messages) if variant is None else digest(model, messages, variant))
+
+    def record_answer(self, model, messages, answer, variant=None, **fields):
+        with self.lock:
+            key = digest(model, messages) if variant is None else digest(model, messages, variant)
+            self.state['api'][key] = answer
+            self.save(**fields)
+
+    def result(self, filename, args, cwd=None):
+        """Recorded output, error and manifest of an identical run in the same folder, or None
+
+        Only a resumed checkpoint replays runs.
+        """
+        if not self.resumed:
+            return None
+        return self.state['runs'].get(digest(script_hash(filename), list(args), os.path.abspath(cwd or os.curdir)))
+
+    def record_run(self, filename, args, output, error, manifest=None, cwd=None, **fields):
+        with self.lock:
+            self.state['scripts'][filename] = script_hash(filename)
+            key = digest(self.state['scripts'][filename], list(args), os.path.abspath(cwd or os.curdir))
+            self.state['runs'][key] = {'output': output, 'error': error, 'manifest': manifest}
+            if manifest is not None:
+                self.state['manifests'][filename] = manifest
+            self.save(**fields)
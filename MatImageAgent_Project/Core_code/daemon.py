@@ -0,0 +1,295 @@
+import os
+import sys
+import json
+import time
+import uuid
+import argparse
+import threading
+import traceback
+import multiprocessing
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from MatImageAgent import CONFIG, ScriptExecutor
+from image_io import IMAGE_CONFIG
+from endpoints import EndpointPool
+from checkpoint import Checkpoint
+from mission_queue import MissionQueue, QUEUE_CONFIG
+
+DAEMON_CONFIG = {
+    'host': '127.0.0.1',
+    'port': 8765,
+    'root': 'missions',
+    'workers': 4,
+    'llm_slots': 4,
+    'cpu_slots': 2,
+    'log_file': 'mission.log',
+    'poll_interval': 0.5
+}
+
+_endpoints = None
+_slots = {}
+
+
+def warm_worker(config, llm_slots, cpu_slots):
+    """Pool initializer: the agent's modules are already imported; open the API clients once per worker"""
+    global _endpoints
+    CONFIG.update(config)
+    # In-process reads (tool mode) share the decoded-image cache with the scripts
+    IMAGE_CONFIG['cache_dir'] = CONFIG['image_cache']
+    _endpoints = EndpointPool.from_config(CONFIG)
+    _slots.update(llm=llm_slots, cpu=cpu_slots)
+
+
+def run_mission(mission_id, workdir, code_str, plan_mode=False):
+    """Run one mission in a warm worker, inside its own directory and with its own log
+
+    Returns True if the mission completed and False if it gave up (error or
+    program-file limit, failed plan node). An attempt that crashed is resumed
+    from its checkpoint; one that gave up is retried from scratch, as
+    replaying its record would only reach the same end.
+    """
+    os.chdir(workdir)
+    stdout = sys.stdout
+    with open(DAEMON_CONFIG['log_file'], 'a', buffering=1, encoding=CONFIG['encoding']) as log:
+        sys.stdout = log
+        try:
+            executor = ScriptExecutor(endpoints=_endpoints)
+            executor.llm_slots, executor.cpu_slots = _slots['llm'], _slots['cpu']
+            if executor.checkpoint:
+                executor.checkpoint = Checkpoint(mission_id)
+                if os.path.exists(executor.checkpoint.path):
+                    executor.checkpoint = Checkpoint.load(mission_id)
+                    print(f'Resuming mission {mission_id} from its checkpoint')
+            if plan_mode:
+                completed = executor.process_plan(code_str)
+            else:
+                completed = executor.process_task(code_str)
+        except SystemExit as e:
+            completed = e.code in (None, 0)
+        except Exception:
+            traceback.print_exc(file=log)
+            raise
+        finally:
+            sys.stdout = stdout
+    if not completed and executor.checkpoint and os.path.exists(executor.checkpoint.path):
+        os.replace(executor.checkpoint.path, executor.checkpoint.path + '.failed')
+    return completed
+
+
+class MissionDaemon:
+    """Long-running agent: a pool of warm mission workers fed from a durable mission queue
+
+    Workers keep their API clients (and their connections), imported libraries and
+    in-memory image cache across missions; the decoded-image cache and the
+    execution memo on disk are shared by all missions. LLM calls and script
+    runs of all missions are capped separately by cross-process semaphores.
+    """
+
+    def __init__(self, root=None, workers=None, llm_slots=None, cpu_slots=None):
+        self.root = os.path.abspath(root or DAEMON_CONFIG['root'])
+        self.workers = workers or DAEMON_CONFIG['workers']
+        cpu_slots = cpu_slots or DAEMON_CONFIG['cpu_slots']
+        os.makedirs(self.root, exist_ok=True)
+        self.queue = MissionQueue(os.path.join(self.root, QUEUE_CONFIG['db']))
+        config = dict(CONFIG, image_cache=os.path.abspath(CONFIG['image_cache']),
+                      memo_dir=os.path.abspath(CONFIG['memo_dir']),
+                      cpu_budget=CONFIG['cpu_budget'] or max(1, (os.cpu_count() or 1) // cpu_slots))
+        slots = (multiprocessing.BoundedSemaphore(llm_slots or DAEMON_CONFIG['llm_slots']),
+                 multiprocessing.BoundedSemaphore(cpu_slots))
+        self.initargs = (config, *slots)
+        self.pool = self.new_pool()
+        self.free = threading.Semaphore(self.workers)
+        self.wake = threading.Event()
+        self.stopping = threading.Event()
+        self.dispatcher = threading.Thread(target=self.dispatch, daemon=True)
+        self.dispatcher.start()
+
+    def new_pool(self):
+        return ProcessPoolExecutor(max_workers=self.workers, initializer=warm_worker, initargs=self.initargs)
+
+    def submit(self, code_str, user='anonymous', priority=0, plan_mode=False):
+        mission_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+        workdir = os.path.join(self.root, mission_id)
+        os.makedirs(workdir)
+        self.queue.submit(mission_id, code_str, workdir, user, priority, plan_mode)
+        self.wake.set()
+        return mission_id
+
+    def dispatch(self):
+        """Hand the next queued mission to each free worker"""
+        while not self.stopping.is_set():
+            self.free.acquire()
+            mission = self.queue.claim()
+            while mission is None and not self.stopping.is_set():
+                self.wake.wait(DAEMON_CONFIG['poll_interval'])
+                self.wake.clear()
+                mission = self.queue.claim()
+            if mission is None:
+                return
+            try:
+                future = self.pool.submit(run_mission, mission['id'], mission['workdir'], mission['md'],
+                                          bool(mission['plan_mode']))
+            except BrokenProcessPool:
+                # A worker died (killed, out of memory); the missions it was running fail through
+                # _done, this one never started: put it back and start a fresh pool
+                print(f"Worker pool broken; restarting it and requeueing {mission['id']}")
+                self.queue.release(mission['id'])
+                self.pool.shutdown(wait=False, cancel_futures=True)
+                self.pool = self.new_pool()
+                self.free.release()
+                continue
+            future.add_done_callback(lambda f, mission_id=mission['id']: self._done(mission_id, f))
+
+    def _done(self, mission_id, future):
+        error = future.exception()
+        if error is not None:
+            error = repr(error)
+        elif not future.result():
+            error = f"Mission failed (see {DAEMON_CONFIG['log_file']})"
+        self.queue.finish(mission_id, error)
+        self.free.release()
+        self.wake.set()
+
+    def status(self, mission_id):
+        mission = self.queue.get(mission_id)
+        mission['files'] = sorted(f for f in os.listdir(mission['workdir'])
+                                  if os.path.isfile(os.path.join(mission['workdir'], f)))
+        return mission
+
+    def log_path(self, mission_id):
+        return os.path.join(self.queue.get(mission_id)['workdir'], DAEMON_CONFIG['log_file'])
+
+    def file_path(self, mission_id, name):
+        """Path of an artefact inside the mission directory (None if it would escape it)"""
+        workdir = os.path.realpath(self.queue.get(mission_id)['workdir'])
+        path = os.path.realpath(os.path.join(workdir, name))
+        return path if path.startswith(workdir + os.sep) and os.path.isfile(path) else None
+
+    def stream(self, mission_id, offset=0):
+        """Yield new log text until the mission has finished or finally failed"""
+        path = self.log_path(mission_id)
+        while True:
+            finished = self.queue.get(mission_id)['status'] in ('finished', 'failed')
+            if os.path.exists(path):
+                with open(path, 'rb') as f:
+                    f.seek(offset)
+                    data = f.read()
+                if data:
+                    offset += len(data)
+                    yield data
+            if finished:
+                return
+            time.sleep(DAEMON_CONFIG['poll_interval'])
+
+    def close(self):
+        self.stopping.set()
+        self.wake.set()
+        self.pool.shutdown(wait=True)
+
+
+class MissionHandler(BaseHTTPRequestHandler):
+    """POST /missions, GET /missions[/<id>[/log|/stream|/files/<name>]] and GET /metrics"""
+
+    agent = None
+
+    def send_json(self, obj, code=200):
+        body = json.dumps(obj, indent=1, default=str).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_bytes(self, data, content_type='application/octet-stream'):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        if urlparse(self.path).path.rstrip('/') != '/missions':
+            return self.send_json({'error': 'not found'}, 404)
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode(CONFIG['encoding'])
+        try:
+            request = json.loads(body)
+        except ValueError:
+            request = {'md': body}
+        if not isinstance(request, dict) or not request.get('md'):
+            return self.send_json({'error': "expected a JSON object with 'md' or the MD text as the body"}, 400)
+        user = request.get('user') or self.headers.get('X-User') or 'anonymous'
+        mission_id = self.agent.submit(request['md'], user, int(request.get('priority', 0)),
+                                       bool(request.get('plan_mode', CONFIG['plan_mode'])))
+        self.send_json({'id': mission_id}, 201)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        parts = [p for p in url.path.split('/') if p]
+        if parts == ['metrics']:
+            return self.send_json(self.agent.queue.metrics())
+        if not parts or parts[0] != 'missions':
+            return self.send_json({'error': 'not found'}, 404)
+        if len(parts) == 1:
+            return self.send_json(self.agent.queue.list(parse_qs(url.query).get('status', [None])[0]))
+        if self.agent.queue.get(parts[1]) is None:
+            return self.send_json({'error': f"unknown mission {parts[1]}"}, 404)
+        mission_id = parts[1]
+
+        if len(parts) == 2:
+            return self.send_json(self.agent.status(mission_id))
+        if parts[2] == 'log':
+            offset = int(parse_qs(url.query).get('offset', ['0'])[0])
+            path = self.agent.log_path(mission_id)
+            data = b''
+            if os.path.exists(path):
+                with open(path, 'rb') as f:
+                    f.seek(offset)
+                    data = f.read()
+            return self.send_bytes(data, 'text/plain; charset=utf-8')
+        if parts[2] == 'stream':
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; charset=utf-8')
+            self.end_headers()
+            for data in self.agent.stream(mission_id):
+                self.wfile.write(data)
+                self.wfile.flush()
+            return
+        if parts[2] == 'files' and len(parts) > 3:
+            path = self.agent.file_path(mission_id, '/'.join(parts[3:]))
+            if path is None:
+                return self.send_json({'error': 'no such file'}, 404)
+            with open(path, 'rb') as f:
+                return self.send_bytes(f.read())
+        self.send_json({'error': 'not found'}, 404)
+
+    def log_message(self, format, *args):
+        print(f"{self.address_string()} {format % args}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve MatImageAgent missions over a local HTTP API.')
+    parser.add_argument('--host', default=DAEMON_CONFIG['host'])
+    parser.add_argument('--port', type=int, default=DAEMON_CONFIG['port'])
+    parser.add_argument('--root', default=DAEMON_CONFIG['root'], help='directory holding one folder per mission')
+    parser.add_argument('--workers', type=int, default=DAEMON_CONFIG['workers'], help='missions run at the same time')
+    parser.add_argument('--llm-slots', type=int, default=DAEMON_CONFIG['llm_slots'], help='concurrent LLM calls')
+    parser.add_argument('--cpu-slots', type=int, default=DAEMON_CONFIG['cpu_slots'], help='concurrent script runs')
+    args = parser.parse_args()
+
+    MissionHandler.agent = MissionDaemon(args.root, args.workers, args.llm_slots, args.cpu_slots)
+    server = ThreadingHTTPServer((args.host, args.port), MissionHandler)
+    print(f"MatImageAgent daemon on http://{args.host}:{args.port}/missions, missions in {MissionHandler.agent.root}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        MissionHandler.agent.close()
+
+
+if __name__ == '__main__':
+    main()
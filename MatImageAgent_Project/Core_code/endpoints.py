@@ -0,0 +1,143 @@
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from openai import OpenAI, APIConnectionError, APIStatusError
+
+from llm_scheduler import LLMScheduler
+
+ENDPOINT_CONFIG = {
+    'hedge_percentile': 90,
+    'hedge_min_samples': 10,
+    'hedge_delay': 60.0,
+    'latency_window': 100,
+    'cooldown': 15.0,
+    'max_cooldown': 600.0,
+    'workers': 16
+}
+
+
+def health_failure(error):
+    """True for errors that say the endpoint is unwell (connection, timeout, 429, 5xx), not the request"""
+    if isinstance(error, APIConnectionError):
+        return True
+    return isinstance(error, APIStatusError) and (error.status_code == 429 or error.status_code >= 500)
+
+
+class Endpoint:
+    """One OpenAI-compatible api_base/model with its client, scheduler and health record"""
+
+    def __init__(self, api_base, api_key, model, rpm=None, tpm=None):
+        self.api_base = api_base
+        self.model = model
+        # Retries are left to the scheduler so it sees every 429
+        self.client = OpenAI(base_url=api_base, api_key=api_key, max_retries=0)
+        self.scheduler = LLMScheduler.for_endpoint(api_base, model, rpm, tpm)
+        self.latencies = deque(maxlen=ENDPOINT_CONFIG['latency_window'])
+        self.failures = 0
+        self.down_until = 0.0
+        self.lock = threading.Lock()
+
+    def __repr__(self):
+        return f"Endpoint({self.api_base!r}, {self.model!r})"
+
+    def healthy(self):
+        return time.time() >= self.down_until
+
+    def hedge_delay(self):
+        """Latency percentile after which a request to this endpoint is hedged elsewhere"""
+        with self.lock:
+            samples = sorted(self.latencies)
+        if len(samples) < ENDPOINT_CONFIG['hedge_min_samples']:
+            return ENDPOINT_CONFIG['hedge_delay']
+        return samples[min(len(samples) - 1, int(ENDPOINT_CONFIG['hedge_percentile'] / 100 * len(samples)))]
+
+    def request(self, messages, kwargs):
+        started = time.time()
+        try:
+            response = self.scheduler.call(
+                lambda: self.client.chat.completions.create(model=self.model, messages=messages, **kwargs),
+                messages, kwargs.get('max_tokens'))
+        except Exception as e:
+            if health_failure(e):
+                with self.lock:
+                    self.failures += 1
+                    self.down_until = time.time() + min(ENDPOINT_CONFIG['max_cooldown'],
+                                                        ENDPOINT_CONFIG['cooldown'] * 2 ** (self.failures - 1))
+            raise
+        with self.lock:
+            self.latencies.append(time.time() - started)
+            self.failures = 0
+            self.down_until = 0.0
+        return response
+
+
+class EndpointPool:
+    """Hedged requests with failover across endpoints, in order of preference
+
+    A request goes to the first healthy endpoint. If it has not answered within
+    that endpoint's latency percentile, the same request is also sent to the
+    next one, and the first good response wins; the slower call is abandoned
+    (a blocking HTTP call cannot be interrupted) and its result discarded. A
+    request that failed for the endpoint's sake (connection, timeout, 429, 5xx)
+    marks it down for a growing cool-down and moves on to the next endpoint; a
+    client error (other 4xx) would fail anywhere and is raised at once.
+    """
+
+    def __init__(self, endpoints):
+        self.endpoints = list(endpoints)
+        self.pool = ThreadPoolExecutor(max_workers=ENDPOINT_CONFIG['workers'])
+        self.stats = {'requests': 0, 'hedged': 0, 'backup_wins': 0, 'failovers': 0}
+
+    @classmethod
+    def from_config(cls, config):
+        """Endpoints listed in config['endpoints'], or the single api_base/api_key/model"""
+        specs = config.get('endpoints') or [{'api_base': config['api_base'], 'api_key': config['api_key'],
+                                             'model': config['model']}]
+        return cls(Endpoint(s['api_base'], s['api_key'], s['model'], s.get('rpm', config.get('rpm')),
+                            s.get('tpm', config.get('tpm'))) for s in specs)
+
+    def ordered(self):
+        """Healthy endpoints first, each group in configured order"""
+        return sorted(self.endpoints, key=lambda e: not e.healthy())
+
+    def complete(self, messages, **kwargs):
+        """Chat completion from the first endpoint to answer successfully"""
+        candidates = self.ordered()
+        pending, errors = {}, []
+        self.stats['requests'] += 1
+
+        def launch():
+            endpoint = candidates.pop(0)
+            pending[self.pool.submit(endpoint.request, messages, kwargs)] = endpoint
+            return time.time() + endpoint.hedge_delay()
+
+        hedge_at = launch()
+        primary = next(iter(pending))
+        while pending:
+            timeout = max(0.0, hedge_at - time.time()) if candidates else None
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                self.stats['hedged'] += 1
+                hedge_at = launch()
+                continue
+            for future in done:
+                pending.pop(future)
+                try:
+                    response = future.result()
+                except Exception as e:
+                    if not health_failure(e):
+                        for other in pending:
+                            other.cancel()
+                        raise
+                    errors.append(e)
+                    if candidates and not pending:
+                        self.stats['failovers'] += 1
+                        hedge_at = launch()
+                    continue
+                for other in pending:
+                    other.cancel()
+                if future is not primary:
+                    self.stats['backup_wins'] += 1
+                return response
+        raise errors[-1]
@@ -0,0 +1,63 @@
+import os
+import numpy as np
+from PIL import Image
+from concurrent.futures import ThreadPoolExecutor
+
+from image_io import file_hash
+from artefacts import temp_path
+
+FIGURE_CONFIG = {
+    'cache_dir': '.figure_cache',
+    'width_px': 1200,
+    'jpeg_quality': 85,
+    'workers': 4
+}
+
+
+def derivative_path(src, width_px, cache_dir):
+    """Cache path of a page-width derivative, keyed by source content hash"""
+    with Image.open(src) as img:
+        ext = '.jpg' if img.format == 'JPEG' else '.png'
+    return os.path.join(cache_dir, f"{file_hash(src)}_w{width_px}{ext}")
+
+
+def prepare_figure(src, width_px=None, cache_dir=None):
+    """Page-width PNG/JPEG derivative of a figure, encoded once and cached"""
+    width_px = width_px or FIGURE_CONFIG['width_px']
+    cache_dir = cache_dir or FIGURE_CONFIG['cache_dir']
+    os.makedirs(cache_dir, exist_ok=True)
+    path = derivative_path(src, width_px, cache_dir)
+    if os.path.exists(path):
+        return path
+
+    with Image.open(src) as img:
+        img.draft('RGB', (width_px, width_px))
+        img = img.convert('L' if img.mode in ('1', 'L') else 'RGB')
+        if img.width > width_px:
+            img = img.resize((width_px, max(1, round(img.height * width_px / img.width))), Image.LANCZOS)
+        tmp = temp_path(path)
+        if path.endswith('.jpg'):
+            img.save(tmp, quality=FIGURE_CONFIG['jpeg_quality'], optimize=True)
+        else:
+            img.save(tmp, optimize=True)
+    os.replace(tmp, path)
+    return path
+
+
+def prepare_figures(paths, width_px=None, cache_dir=None, workers=None):
+    """Prepare derivatives of several figures in parallel, in input order"""
+    with ThreadPoolExecutor(max_workers=workers or FIGURE_CONFIG['workers']) as pool:
+        return list(pool.map(lambda p: prepare_figure(p, width_px, cache_dir), paths))
+
+
+def gap_overview(mask, path, width_px=None):
+    """Page-width GAP overview straight from a boolean mask: darker blocks hold more GAP pixels"""
+    width_px = width_px or FIGURE_CONFIG['width_px']
+    mask = np.asarray(mask, dtype=bool)
+    h, w = mask.shape
+    block = max(1, -(-w // width_px))
+    padded = np.zeros((-(-h // block) * block, -(-w // block) * block), dtype=np.float32)
+    padded[:h, :w] = mask
+    density = padded.reshape(padded.shape[0] // block, block, -1, block).mean(axis=(1, 3))
+    Image.fromarray((255 * (1 - density)).astype(np.uint8)).save(path, optimize=True)
+    return path
@@ -0,0 +1,535 @@
+import os
+import csv
+import hashlib
+import numpy as np
+from PIL import Image
+from scipy import ndimage
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+import image_io
+
+# GAP rule of the MDs: grayscale in [low, high] and connected (up/down/left/right)
+# to at least k pixels meeting the grayscale condition
+FOUR_CONNECTED = ndimage.generate_binary_structure(2, 1)
+
+GAP_CONFIG = {
+    'low': 12,
+    'high': 18,
+    'k': 20,
+    'tile': 2048,
+    'workers': 1,
+    'cache_dir': '.gap_cache',
+    # A sweep step adding more than this fraction of the pixels relabels from scratch
+    'relabel_fraction': 0.05
+}
+
+
+class UnionFind:
+    """Vectorised union-find over dense integer ids
+
+    size[r] is the size of the set rooted at r and hist[s] the number of sets of
+    size s; union() keeps both up to date at a cost proportional to its input.
+    """
+
+    def __init__(self, n):
+        self.parent = np.arange(n, dtype=np.int64)
+        self.size = np.ones(n, dtype=np.int64)
+        self.hist = np.zeros(n + 1, dtype=np.int64)
+        self.hist[1:2] = n
+        self._slot = np.empty(n, dtype=np.int64)
+
+    @classmethod
+    def from_labels(cls, labels):
+        """Union-find holding the components of a label array (0 = unlabelled singletons)"""
+        flat = np.asarray(labels).ravel()
+        uf = cls(flat.size)
+        members = np.flatnonzero(flat)
+        rep = np.zeros(int(flat.max(initial=0)) + 1, dtype=np.int64)
+        # Reversed so the smallest member of each component is written last
+        rep[flat[members[::-1]]] = members[::-1]
+        uf.parent[members] = rep[flat[members]]
+        uf.size[rep[1:]] = np.bincount(flat, minlength=rep.size)[1:]
+        uf.hist[:] = size_histogram(labels)
+        return uf
+
+    def roots(self, idx=None):
+        """Return the root of every id in idx (all ids if None), compressing paths"""
+        if idx is not None:
+            return self.find(idx)
+        parent = self.parent
+        while True:
+            grand = parent[parent]
+            if np.array_equal(grand, parent):
+                break
+            parent[:] = grand
+        return parent
+
+    def find(self, idx):
+        """Roots of the ids in idx, compressing only their own paths"""
+        idx = np.asarray(idx, dtype=np.int64)
+        root = self.parent[idx]
+        moving = np.flatnonzero(self.parent[root] != root)
+        while moving.size:
+            root[moving] = self.parent[root[moving]]
+            moving = moving[self.parent[root[moving]] != root[moving]]
+        self.parent[idx] = root
+        return root
+
+    def _distinct(self, ids):
+        """ids without repeats, in time proportional to len(ids)"""
+        order = np.arange(ids.size)
+        self._slot[ids] = order
+        return ids[self._slot[ids] == order]
+
+    def union(self, a, b):
+        """Merge the sets of every pair (a[i], b[i])"""
+        a = np.asarray(a, dtype=np.int64)
+        b = np.asarray(b, dtype=np.int64)
+        while a.size:
+            ra, rb = self.find(a), self.find(b)
+            pending = ra != rb
+            if not pending.any():
+                break
+            ra, rb = ra[pending], rb[pending]
+            # Hook the larger root under the smaller one; colliding writes are
+            # resolved by the next round
+            hooked = self._distinct(np.maximum(ra, rb))
+            self.parent[np.maximum(ra, rb)] = np.minimum(ra, rb)
+            # Every hooked root now lies under a surviving root: move its size there
+            top = self.find(hooked)
+            merged = self._distinct(top)
+            np.subtract.at(self.hist, self.size[hooked], 1)
+            np.subtract.at(self.hist, self.size[merged], 1)
+            np.add.at(self.size, top, self.size[hooked])
+            np.add.at(self.hist, self.size[merged], 1)
+            a, b = a[pending], b[pending]
+
+
+def in_range_mask(gray, low, high):
+    """Pixels meeting the grayscale condition"""
+    return (gray >= low) & (gray <= high)
+
+
+def label_components(mask):
+    """Label 4-connected components of a boolean mask"""
+    return ndimage.label(mask, structure=FOUR_CONNECTED)
+
+
+def component_size_map(mask):
+    """Size of the 4-connected component each pixel belongs to (0 outside the mask)"""
+    labels, n = label_components(mask)
+    sizes = np.bincount(labels.ravel(), minlength=n + 1)
+    sizes[0] = 0
+    return sizes[labels]
+
+
+def size_histogram(labels):
+    """Number of components of each size, unlabelled pixels counting as singletons"""
+    flat = np.asarray(labels).ravel()
+    counts = np.bincount(flat)
+    hist = np.bincount(counts[1:], minlength=flat.size + 1)[:flat.size + 1]
+    hist[1] += counts[0] if counts.size else 0
+    return hist
+
+
+def neighbour_max_map(size_map):
+    """Largest component size among each pixel and its 4-neighbours"""
+    padded = np.pad(size_map, 1)
+    return np.maximum.reduce([padded[1:-1, 1:-1], padded[:-2, 1:-1], padded[2:, 1:-1],
+                              padded[1:-1, :-2], padded[1:-1, 2:]])
+
+
+def image_hash(gray):
+    """Content hash of a grayscale array (shape, dtype and pixel bytes)"""
+    digest = hashlib.sha1(f"{gray.shape}{gray.dtype}".encode())
+    digest.update(np.ascontiguousarray(gray).data)
+    return digest.hexdigest()
+
+
+def gap_mask(gray, low=None, high=None, k=None):
+    """Boolean GAP mask of a grayscale image"""
+    low = GAP_CONFIG['low'] if low is None else low
+    high = GAP_CONFIG['high'] if high is None else high
+    k = GAP_CONFIG['k'] if k is None else k
+    return component_size_map(in_range_mask(gray, low, high)) >= k
+
+
+@contextmanager
+def _no_pixel_limit():
+    """Lift PIL's decompression-bomb check for one montage the caller asked to process"""
+    limit = Image.MAX_IMAGE_PIXELS
+    Image.MAX_IMAGE_PIXELS = None
+    try:
+        yield
+    finally:
+        Image.MAX_IMAGE_PIXELS = limit
+
+
+def image_to_npy(path, cache_dir=None):
+    """Grayscale .npy copy of an image file, named by its content hash and made once
+
+    PNG and most other formats can only be decoded whole, so the image is
+    decoded a single time here; tiles are then read from the memory-mapped copy.
+    """
+    cache_dir = cache_dir or GAP_CONFIG['cache_dir']
+    os.makedirs(cache_dir, exist_ok=True)
+    npy_path = os.path.join(cache_dir, f"{image_io.file_hash(path)}_gray.npy")
+    if not os.path.exists(npy_path):
+        with _no_pixel_limit(), Image.open(path) as img:
+            gray = img.convert('L')
+        tmp = f"{npy_path}.{os.getpid()}.tmp"
+        with open(tmp, 'wb') as f:
+            np.save(f, np.asarray(gray))
+        del gray
+        os.replace(tmp, npy_path)
+    return npy_path
+
+
+def open_source(source, cache_dir=None):
+    """Open an ndarray or a .npy file (memory-mapped); other image files are converted to .npy first"""
+    if isinstance(source, np.ndarray):
+        return source
+    if str(source).lower().endswith('.npy'):
+        return np.load(source, mmap_mode='r')
+    return np.load(image_to_npy(source, cache_dir), mmap_mode='r')
+
+
+class TiledGapScheduler:
+    """Halo-aware tiled GAP detection for images larger than memory
+
+    Each tile is labelled together with a halo of at least k - 1 pixels. A
+    component that reaches the inner edge of the halo is then known to hold at
+    least k pixels, so the GAP flag of every core pixel is exact without seeing
+    the whole image. Component labels are merged across tile seams with a
+    union-find in a second streaming pass. Results are written to .npy files.
+    Memory stays bounded for .npy sources, which are read memory-mapped; any
+    other image file is decoded once up front into a .npy under cache_dir.
+    """
+
+    def __init__(self, source, output_dir, low=None, high=None, k=None,
+                 tile=None, halo=None, workers=None, cache_dir=None):
+        self.source = open_source(source, cache_dir)
+        self.output_dir = output_dir
+        self.low = GAP_CONFIG['low'] if low is None else low
+        self.high = GAP_CONFIG['high'] if high is None else high
+        self.k = GAP_CONFIG['k'] if k is None else k
+        self.tile = tile or GAP_CONFIG['tile']
+        self.halo = max(self.k, halo or 0)
+        self.workers = workers or GAP_CONFIG['workers']
+        self.shape = tuple(self.source.shape[:2])
+
+    def tiles(self):
+        """Core tile boxes (r0, r1, c0, c1) in row-major order"""
+        h, w = self.shape
+        return [(r0, min(r0 + self.tile, h), c0, min(c0 + self.tile, w))
+                for r0 in range(0, h, self.tile)
+                for c0 in range(0, w, self.tile)]
+
+    def _label_tile(self, box):
+        """Pass 1: exact GAP flags and tile-local labels for one core tile"""
+        r0, r1, c0, c1 = box
+        h, w = self.shape
+        wr0, wr1 = max(r0 - self.halo, 0), min(r1 + self.halo, h)
+        wc0, wc1 = max(c0 - self.halo, 0), min(c1 + self.halo, w)
+        window = np.asarray(self.source[wr0:wr1, wc0:wc1])
+
+        labels, n = label_components(in_range_mask(window, self.low, self.high))
+        keep = np.bincount(labels.ravel(), minlength=n + 1) >= self.k
+        # Components cut by the window edge inside the image span the halo
+        for edge, cut in ((labels[0], wr0 > 0), (labels[-1], wr1 < h),
+                          (labels[:, 0], wc0 > 0), (labels[:, -1], wc1 < w)):
+            if cut:
+                keep[edge] = True
+        keep[0] = False
+
+        core = keep[labels[r0 - wr0:r1 - wr0, c0 - wc0:c1 - wc0]]
+        local, nc = label_components(core)
+        self.mask[r0:r1, c0:c1] = core
+        self.labels[r0:r1, c0:c1] = local
+        edges = (local[0].copy(), local[-1].copy(), local[:, 0].copy(), local[:, -1].copy())
+        return nc, np.bincount(local.ravel(), minlength=nc + 1)[1:], edges
+
+    def _relabel_tile(self, box, lut):
+        """Pass 2: replace tile-local labels with global component ids"""
+        r0, r1, c0, c1 = box
+        self.labels[r0:r1, c0:c1] = lut[self.labels[r0:r1, c0:c1]]
+
+    def run(self, name='gap'):
+        """Process all tiles and return a summary of the written files"""
+        os.makedirs(self.output_dir, exist_ok=True)
+        mask_path = os.path.join(self.output_dir, f"{name}_mask.npy")
+        labels_path = os.path.join(self.output_dir, f"{name}_labels.npy")
+        self.mask = np.lib.format.open_memmap(mask_path, mode='w+', dtype=bool, shape=self.shape)
+        self.labels = np.lib.format.open_memmap(labels_path, mode='w+', dtype=np.int32, shape=self.shape)
+
+        boxes = self.tiles()
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            results = list(pool.map(self._label_tile, boxes))
+
+        counts = np.array([r[0] for r in results], dtype=np.int64)
+        offsets = np.concatenate(([0], np.cumsum(counts)))
+        uf = UnionFind(int(offsets[-1]))
+        index = {box[::2]: i for i, box in enumerate(boxes)}
+        for i, (r0, r1, c0, c1) in enumerate(boxes):
+            _, _, (top, bottom, left, right) = results[i]
+            for j, a, b in ((index.get((r1, c0)), bottom, 0), (index.get((r0, c1)), right, 2)):
+                if j is None:
+                    continue
+                b = results[j][2][b]
+                both = (a > 0) & (b > 0)
+                uf.union(offsets[i] + a[both] - 1, offsets[j] + b[both] - 1)
+
+        _, compact = np.unique(uf.roots(), return_inverse=True)
+        sizes = np.bincount(compact, weights=np.concatenate([r[1] for r in results])).astype(np.int64)
+        luts = [np.concatenate(([0], compact[offsets[i]:offsets[i + 1]] + 1)).astype(np.int32)
+                for i in range(len(boxes))]
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            list(pool.map(self._relabel_tile, boxes, luts))
+
+        self.mask.flush()
+        self.labels.flush()
+        return {
+            'mask_path': mask_path,
+            'labels_path': labels_path,
+            'n_components': int(sizes.size),
+            'gap_pixels': int(sizes.sum()),
+            'component_sizes': sizes
+        }
+
+
+def tiled_gap_mask(source, output_dir, **kwargs):
+    """Run the tiled GAP scheduler on source and return its summary"""
+    return TiledGapScheduler(source, output_dir, **kwargs).run()
+
+
+class ThresholdSweep:
+    """GAP masks and pixel counts for a grid of (low, high, k) from one sorted pass
+
+    Pixels are sorted by intensity once. For every lower bound the components
+    are then grown incrementally with a union-find while the upper bound rises;
+    GAP-pixel counts come from the union-find's component-size histogram, so
+    each step costs in proportion to the pixels it adds. Masks are built only
+    when asked for.
+    """
+
+    def __init__(self, gray, lows, highs, ks):
+        self.gray = np.asarray(gray)
+        self.lows = sorted(lows)
+        self.highs = sorted(highs)
+        self.ks = sorted(ks)
+        self.counts = {}
+
+    def _activate(self, idx, active):
+        """Mark pixels idx active and return the pairs (p, q) joining them to active 4-neighbours
+
+        Looking back only at pixels active before this call and forward at all
+        active pixels lists each new-new pair once.
+        """
+        h, w = self.gray.shape
+        col = idx % w
+        pairs = []
+
+        def join(step, valid):
+            p = idx[valid]
+            q = p + step
+            hit = active[q]
+            pairs.append((p[hit], q[hit]))
+
+        join(-1, col > 0)
+        join(-w, idx >= w)
+        active[idx] = True
+        join(1, col < w - 1)
+        join(w, idx < (h - 1) * w)
+        return np.concatenate([p for p, _ in pairs]), np.concatenate([q for _, q in pairs])
+
+    def run(self):
+        """Sweep the grid and return {(low, high, k): GAP pixel count}"""
+        flat = self.gray.ravel()
+        order = np.argsort(flat, kind='stable')
+        values = flat[order]
+
+        for low in self.lows:
+            highs = [high for high in self.highs if high >= low]
+            if not highs:
+                continue
+            start = pos = np.searchsorted(values, low, side='left')
+            labels = uf = None
+            for high in highs:
+                end = np.searchsorted(values, high, side='right')
+                if labels is None or end - pos > GAP_CONFIG['relabel_fraction'] * flat.size:
+                    # A large step is cheaper to label in one C pass than to union pixel by pixel
+                    active = in_range_mask(flat, low, high)
+                    labels = label_components(active.reshape(self.gray.shape))[0]
+                    hist, uf = size_histogram(labels), None
+                else:
+                    if uf is None:
+                        uf = UnionFind.from_labels(labels)
+                    uf.union(*self._activate(order[pos:end], active))
+                    hist = uf.hist
+                pos = end
+
+                # Inactive pixels are singleton sets, so components of >= 2
+                # pixels are all active: GAP pixels = all pixels minus those
+                # in sets smaller than k
+                small = np.cumsum(np.arange(max(self.ks)) * hist[:max(self.ks)])
+                for k in self.ks:
+                    if k <= 0:
+                        n = flat.size
+                    elif k == 1:
+                        n = end - start
+                    else:
+                        n = flat.size - small[k - 1]
+                    self.counts[(low, high, k)] = int(n)
+        return self.counts
+
+    def mask(self, low, high, k):
+        """GAP mask for one grid point"""
+        return gap_mask(self.gray, low, high, k)
+
+    def masks(self):
+        """GAP masks for every grid point"""
+        return {key: self.mask(*key) for key in self.counts}
+
+
+def threshold_sweep(gray, lows, highs, ks):
+    """Run a threshold-range sweep and return the finished ThresholdSweep"""
+    sweep = ThresholdSweep(gray, lows, highs, ks)
+    sweep.run()
+    return sweep
+
+
+class ComponentSizeCache:
+    """Persistent per-image component-size maps so the GAP mask for any k is one comparison
+
+    Entries are keyed by image content hash and threshold range, kept in memory
+    and stored as .npz files under cache_dir.
+    """
+
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir or GAP_CONFIG['cache_dir']
+        self.entries = {}
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key[0]}_{key[1]}_{key[2]}.npz")
+
+    def get(self, gray, low, high):
+        """Return (in_range, size_map, neighbour_max) for an image and threshold range"""
+        gray = np.asarray(gray)
+        key = (image_hash(gray), low, high)
+        if key in self.entries:
+            return self.entries[key]
+
+        path = self._path(key)
+        if os.path.exists(path):
+            with np.load(path) as data:
+                entry = (data['in_range'], data['size_map'], data['neighbour_max'])
+        else:
+            in_range = in_range_mask(gray, low, high)
+            size_map = component_size_map(in_range).astype(np.uint32)
+            entry = (in_range, size_map, neighbour_max_map(size_map))
+            tmp = path + '.tmp.npz'
+            np.savez(tmp, in_range=entry[0], size_map=entry[1], neighbour_max=entry[2])
+            os.replace(tmp, path)
+        self.entries[key] = entry
+        return entry
+
+    def gap_mask(self, gray, low, high, k):
+        """GAP mask: in range and next to a component of at least k pixels"""
+        in_range, _, neighbour_max = self.get(gray, low, high)
+        return in_range & (neighbour_max >= k)
+
+
+def column_statistics(mask, re=1.0):
+    """Per-column and per-void GAP heights of a mask or a stack of masks
+
+    mask is (h, w) or (n, h, w). Column heights follow MD_T1:
+    (max_row - min_row + 1) * re, using the first GAP row of the mask and of
+    its vertically flipped copy. Voids are 4-connected GAP components, labelled
+    per image; void_image gives the image each void belongs to.
+    """
+    mask = np.asarray(mask, dtype=bool)
+    stack = mask if mask.ndim == 3 else mask[np.newaxis]
+    h = stack.shape[1]
+
+    has_gap = stack.any(axis=1)
+    first_row = np.where(has_gap, stack.argmax(axis=1), -1)
+    last_row = np.where(has_gap, h - 1 - stack[:, ::-1, :].argmax(axis=1), -1)
+    heights = np.where(has_gap, (last_row - first_row + 1) * re, 0.0)
+    counts = stack.sum(axis=1)
+    n_cols = has_gap.sum(axis=1)
+    max_height = heights.max(axis=1) if heights.size else np.zeros(len(stack))
+    avg_height = np.divide(heights.sum(axis=1), n_cols,
+                           out=np.zeros(len(stack)), where=n_cols > 0)
+
+    # In-plane connectivity only, so voids never join across stacked images
+    structure = np.zeros((3, 3, 3), dtype=bool)
+    structure[1] = FOUR_CONNECTED
+    labels, _ = ndimage.label(stack, structure=structure)
+    objects = ndimage.find_objects(labels)
+    void_image = np.array([s[0].start for s in objects], dtype=np.int64)
+    void_heights = np.array([(s[1].stop - s[1].start) * re for s in objects], dtype=float)
+
+    stats = {
+        'first_row': first_row,
+        'last_row': last_row,
+        'column_heights': heights,
+        'column_counts': counts,
+        'max_height': max_height,
+        'avg_height': avg_height,
+        'void_image': void_image,
+        'void_heights': void_heights
+    }
+    if mask.ndim == 2:
+        for key in ('first_row', 'last_row', 'column_heights', 'column_counts'):
+            stats[key] = stats[key][0]
+        stats['max_height'] = float(max_height[0])
+        stats['avg_height'] = float(avg_height[0])
+    return stats
+
+
+REGION_COLUMNS = ['label', 'area', 'min_row', 'min_col', 'max_row', 'max_col',
+                  'centroid_row', 'centroid_col', 'height_um', 'width_um', 'mean_gray']
+
+
+def region_table(gray, mask, re=1.0):
+    """One row per connected GAP component, as a dict of column arrays"""
+    labels, n = label_components(mask)
+    flat = labels.ravel()
+    rows, cols = np.indices(labels.shape)
+    area = np.bincount(flat, minlength=n + 1)[1:]
+    safe_area = np.maximum(area, 1)
+    objects = ndimage.find_objects(labels)
+    bbox = np.array([(s[0].start, s[1].start, s[0].stop - 1, s[1].stop - 1) for s in objects],
+                    dtype=np.int64).reshape(-1, 4)
+    return {
+        'label': np.arange(1, n + 1),
+        'area': area,
+        'min_row': bbox[:, 0],
+        'min_col': bbox[:, 1],
+        'max_row': bbox[:, 2],
+        'max_col': bbox[:, 3],
+        'centroid_row': np.bincount(flat, weights=rows.ravel(), minlength=n + 1)[1:] / safe_area,
+        'centroid_col': np.bincount(flat, weights=cols.ravel(), minlength=n + 1)[1:] / safe_area,
+        'height_um': (bbox[:, 2] - bbox[:, 0] + 1) * re,
+        'width_um': (bbox[:, 3] - bbox[:, 1] + 1) * re,
+        'mean_gray': np.bincount(flat, weights=np.asarray(gray, dtype=float).ravel(),
+                                 minlength=n + 1)[1:] / safe_area
+    }
+
+
+def save_region_table(table, path):
+    """Write a region table as CSV"""
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(REGION_COLUMNS)
+        for row in zip(*(table[c] for c in REGION_COLUMNS)):
+            # repr precision, so montage-scale centroids survive a round trip
+            writer.writerow([repr(float(v)) if isinstance(v, float) else int(v) for v in row])
+
+
+def load_region_table(path):
+    """Read a region table written by save_region_table"""
+    data = np.genfromtxt(path, delimiter=',', names=True, ndmin=1)
+    return {c: data[c] for c in REGION_COLUMNS}
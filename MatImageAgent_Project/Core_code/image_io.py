@@ -0,0 +1,148 @@
+import os
+import hashlib
+import threading
+import numpy as np
+from collections import OrderedDict
+from PIL import Image
+
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
+# Shared by every step of a mission through the environment set by the agent
+CACHE_ENV_VAR = 'MATIMAGE_IMAGE_CACHE'
+
+IMAGE_CONFIG = {
+    'cache_dir': '.image_cache',
+    'memory_entries': 32
+}
+
+
+def file_hash(path):
+    """SHA-1 of a file's bytes"""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def gray_decoder(reduce=1):
+    """Decoder used for a read: PIL at full size, OpenCV's reduced decode for drafts when available"""
+    return 'cv2' if cv2 is not None and reduce > 1 else 'pil'
+
+
+def decode_gray(path, reduce=1):
+    """Decode an image directly to 8-bit grayscale, optionally at 1/2, 1/4 or 1/8 size
+
+    Full-size reads use PIL's convert('L'), as the MDs prescribe; OpenCV's
+    grayscale weights and JPEG decoder give different values (by up to 14
+    levels on colour JPEGs), which moves pixels across the GAP band.
+    """
+    if gray_decoder(reduce) == 'cv2':
+        flags = {2: cv2.IMREAD_REDUCED_GRAYSCALE_2, 4: cv2.IMREAD_REDUCED_GRAYSCALE_4,
+                 8: cv2.IMREAD_REDUCED_GRAYSCALE_8}
+        gray = cv2.imread(path, flags[reduce])
+        if gray is not None:
+            return gray
+
+    with Image.open(path) as img:
+        full_width = img.width
+        if reduce > 1:
+            # JPEG draft mode decodes at reduced scale; finish the reduction below
+            img.draft('L', (img.width // reduce, img.height // reduce))
+        gray = img.convert('L')
+    remaining = round(reduce * gray.width / full_width)
+    if remaining > 1:
+        gray = gray.reduce(remaining)
+    return np.asarray(gray)
+
+
+class ImageCache:
+    """LRU cache of decoded grayscale arrays shared between processes
+
+    Arrays are kept in memory (LRU) and as .npy files named by the content hash
+    of the source file, which later processes load memory-mapped. The
+    in-memory key includes the path, mtime and size, so a changed file is
+    decoded again.
+    """
+
+    def __init__(self, cache_dir=None, memory_entries=None):
+        # Absolute, so a worker that changes directory between missions keeps using it
+        self.cache_dir = os.path.abspath(cache_dir or os.environ.get(CACHE_ENV_VAR) or IMAGE_CONFIG['cache_dir'])
+        self.memory_entries = memory_entries or IMAGE_CONFIG['memory_entries']
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def get(self, path, reduce=1):
+        """Read-only grayscale array of an image file, decoded at most once per content"""
+        stat = os.stat(path)
+        key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size, reduce)
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key]
+
+        npy_path = os.path.join(self.cache_dir, f"{file_hash(path)}_r{reduce}_{gray_decoder(reduce)}.npy")
+        if os.path.exists(npy_path):
+            gray = np.load(npy_path, mmap_mode='r')
+        else:
+            gray = decode_gray(path, reduce)
+            gray.setflags(write=False)
+            tmp = f"{npy_path}.{os.getpid()}.tmp"
+            with open(tmp, 'wb') as f:
+                np.save(f, gray)
+            os.replace(tmp, npy_path)
+
+        with self.lock:
+            self.entries[key] = gray
+            while len(self.entries) > self.memory_entries:
+                self.entries.popitem(last=False)
+        return gray
+
+    def clear(self):
+        """Drop the in-memory entries (files on disk are kept)"""
+        with self.lock:
+            self.entries.clear()
+
+
+_shared_cache = None
+
+
+def shared_cache():
+    """Process-wide ImageCache"""
+    global _shared_cache
+    if _shared_cache is None:
+        _shared_cache = ImageCache()
+    return _shared_cache
+
+
+def read_gray(path, reduce=1):
+    """Cached grayscale decode; repeat reads within a mission are free"""
+    return shared_cache().get(path, reduce)
+
+
+def save_mask(mask, path, colors=None):
+    """Write a boolean GAP mask as a 1-bit image (GAP black, other pixels white)
+
+    colors=(gap_rgb, background_rgb) writes a 1-bit palette PNG instead.
+    """
+    mask = np.asarray(mask, dtype=bool)
+    if colors is None:
+        Image.fromarray(~mask).save(path)
+        return path
+    img = Image.fromarray(mask.astype(np.uint8), mode='L').convert('P')
+    img.putpalette([*colors[1], *colors[0]])
+    img.save(path, bits=1, optimize=True)
+    return path
+
+
+def overlay_mask(gray, mask, color=(255, 0, 0), alpha=1.0):
+    """RGB figure of a grayscale image with GAP pixels blended in color; only for human-facing output"""
+    rgb = np.repeat(np.asarray(gray, dtype=np.uint8)[..., np.newaxis], 3, axis=-1)
+    mask = np.asarray(mask, dtype=bool)
+    blended = (1 - alpha) * rgb[mask] + alpha * np.asarray(color, dtype=float)
+    rgb[mask] = np.clip(blended, 0, 255).astype(np.uint8)
+    return rgb
@@ -0,0 +1,49 @@
+import numpy as np
+
+LINE_CONFIG = {
+    'u_min': 0,
+    'u_max': 65535
+}
+
+
+def line_points(start_point, end_point):
+    """Integer (x, y) pixels from start to end, one per step along the longer axis"""
+    (x0, y0), (x1, y1) = start_point, end_point
+    n = max(abs(x1 - x0), abs(y1 - y0)) + 1
+    xs = np.rint(np.linspace(x0, x1, n)).astype(np.intp)
+    ys = np.rint(np.linspace(y0, y1, n)).astype(np.intp)
+    return xs, ys
+
+
+def u_eq(gray_values, u_min=None, u_max=None):
+    """u_eq = u_min + (gray_values / 255) * u_max"""
+    u_min = LINE_CONFIG['u_min'] if u_min is None else u_min
+    u_max = LINE_CONFIG['u_max'] if u_max is None else u_max
+    return u_min + (np.asarray(gray_values, dtype=float) / 255) * u_max
+
+
+def sample_line(gray, start_point, end_point, u_min=None, u_max=None):
+    """Resolution-independent line sample: grayscale values, u_eq and distances in pixels"""
+    xs, ys = line_points(start_point, end_point)
+    (x0, y0), (x1, y1) = start_point, end_point
+    length_px = float(np.hypot(x1 - x0, y1 - y0))
+    values = np.asarray(gray)[ys, xs]
+    return {
+        'start_point': tuple(start_point),
+        'end_point': tuple(end_point),
+        'xs': xs,
+        'ys': ys,
+        'gray': values,
+        'u_eq': u_eq(values, u_min, u_max),
+        'distance_px': np.linspace(0.0, length_px, xs.size),
+        'length_px': length_px
+    }
+
+
+def scale_profile(sample, resolution):
+    """Resolution-dependent part of a line profile: distances and length in um"""
+    return {
+        'resolution': resolution,
+        'distance_um': sample['distance_px'] * resolution,
+        'length_um': sample['length_px'] * resolution
+    }
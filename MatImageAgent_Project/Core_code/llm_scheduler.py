@@ -0,0 +1,175 @@
+import json
+import time
+import random
+import threading
+from openai import APIConnectionError, APITimeoutError, APIStatusError
+
+SCHEDULER_CONFIG = {
+    'rpm': None,
+    'tpm': None,
+    'initial_concurrency': 4,
+    'max_concurrency': 32,
+    'retries': 6,
+    'backoff_base': 1.0,
+    'backoff_cap': 60.0,
+    'latency_spike': 2.0,
+    'chars_per_token': 4
+}
+
+# Worth retrying: throttling, timeouts, conflicts and server-side failures
+RETRY_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """Refills at per_minute / 60 per second up to one minute's worth"""
+
+    def __init__(self, per_minute):
+        self.rate = per_minute / 60.0
+        self.capacity = float(per_minute)
+        self.tokens = self.capacity
+        self.stamp = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def acquire(self, n=1):
+        """Block until n tokens are available and take them (a request larger than the bucket waits for a full one)"""
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= min(n, self.capacity):
+                    self.tokens -= n
+                    return
+                wait = (min(n, self.capacity) - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def credit(self, n):
+        """Return tokens reserved but not used"""
+        with self.lock:
+            self._refill()
+            self.tokens = min(self.capacity, self.tokens + n)
+
+
+class AdaptiveConcurrency:
+    """AIMD limit on requests in flight
+
+    Halves on throttling, shrinks when latency per output token spikes above
+    its slow-moving baseline, and grows by about one slot per window of
+    healthy requests while the limit is fully used.
+    """
+
+    def __init__(self, initial=None, maximum=None):
+        self.limit = float(initial or SCHEDULER_CONFIG['initial_concurrency'])
+        self.maximum = maximum or SCHEDULER_CONFIG['max_concurrency']
+        self.in_flight = 0
+        self.baseline = None
+        self.cond = threading.Condition()
+
+    def acquire(self):
+        with self.cond:
+            while self.in_flight >= int(self.limit):
+                self.cond.wait()
+            self.in_flight += 1
+
+    def release(self, latency=None, throttled=False):
+        with self.cond:
+            saturated = self.in_flight >= int(self.limit)
+            self.in_flight -= 1
+            if throttled:
+                self.limit = max(1.0, self.limit / 2)
+            elif latency is not None:
+                if self.baseline is not None and latency > self.baseline * SCHEDULER_CONFIG['latency_spike']:
+                    self.limit = max(1.0, self.limit * 0.8)
+                elif saturated:
+                    self.limit = min(self.maximum, self.limit + 1 / self.limit)
+                self.baseline = latency if self.baseline is None else 0.95 * self.baseline + 0.05 * latency
+            self.cond.notify_all()
+
+
+def estimate_tokens(messages, max_tokens):
+    """Prompt size from its characters plus the completion budget, as providers count TPM"""
+    chars = len(json.dumps(messages, ensure_ascii=False, default=str))
+    return chars // SCHEDULER_CONFIG['chars_per_token'] + (max_tokens or 0)
+
+
+def retry_after(error):
+    response = getattr(error, 'response', None)
+    try:
+        return float(response.headers.get('retry-after'))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+class LLMScheduler:
+    """Client-side scheduler for one api_base/model: RPM and TPM buckets, adaptive concurrency, jittered retries"""
+
+    _registry = {}
+    _registry_lock = threading.Lock()
+
+    def __init__(self, rpm=None, tpm=None):
+        rpm = rpm or SCHEDULER_CONFIG['rpm']
+        tpm = tpm or SCHEDULER_CONFIG['tpm']
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self.concurrency = AdaptiveConcurrency()
+        self.paused_until = 0.0
+        self.stats = {'requests': 0, 'throttled': 0, 'retries': 0, 'failures': 0}
+
+    @classmethod
+    def for_endpoint(cls, api_base, model, rpm=None, tpm=None):
+        """Scheduler shared by every caller of the same endpoint in this process"""
+        with cls._registry_lock:
+            if (api_base, model) not in cls._registry:
+                cls._registry[(api_base, model)] = cls(rpm, tpm)
+            return cls._registry[(api_base, model)]
+
+    def call(self, request, messages, max_tokens=None):
+        """Run request() under the limits, retrying throttled and transient failures"""
+        estimate = estimate_tokens(messages, max_tokens)
+        for attempt in range(SCHEDULER_CONFIG['retries'] + 1):
+            pause = self.paused_until - time.time()
+            if pause > 0:
+                time.sleep(pause)
+            if self.requests:
+                self.requests.acquire()
+            if self.tokens:
+                self.tokens.acquire(estimate)
+
+            self.concurrency.acquire()
+            started = time.time()
+            error, latency, throttled = None, None, False
+            try:
+                response = request()
+                usage = getattr(response, 'usage', None)
+                completion = getattr(usage, 'completion_tokens', None) or 0
+                latency = (time.time() - started) / max(1, completion)
+            except (APIConnectionError, APITimeoutError, APIStatusError) as e:
+                error = e
+                throttled = getattr(e, 'status_code', None) == 429
+            finally:
+                # Any other exception leaves through here too and must not keep the slot
+                self.concurrency.release(latency, throttled=throttled)
+
+            if error is not None:
+                self.stats['throttled' if throttled else 'failures'] += 1
+                transient = isinstance(error, (APIConnectionError, APITimeoutError)) or error.status_code in RETRY_STATUS
+                if not transient or attempt == SCHEDULER_CONFIG['retries']:
+                    raise error
+                # Full jitter, but never sooner than the provider asked for
+                delay = random.uniform(0, min(SCHEDULER_CONFIG['backoff_cap'],
+                                              SCHEDULER_CONFIG['backoff_base'] * 2 ** attempt))
+                wait = retry_after(error)
+                if wait:
+                    delay = max(delay, wait)
+                    self.paused_until = max(self.paused_until, time.time() + wait)
+                self.stats['retries'] += 1
+                time.sleep(delay)
+                continue
+
+            self.stats['requests'] += 1
+            if self.tokens and getattr(usage, 'total_tokens', None):
+                self.tokens.credit(estimate - usage.total_tokens)
+            return response
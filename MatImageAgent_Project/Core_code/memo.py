@@ -0,0 +1,305 @@
+"""Execution memo store: an identical script on identical inputs is satisfied from cache
+
+Run as a program, this module is the tracer the agent launches scripts with:
+    python memo.py <trace.json> <script.py> [args...]
+It records the files the script reads (with their content hashes at first
+read), the directories it lists and the files it writes, then dumps them to
+trace.json. Only the standard library is imported at the top so the tracer
+adds next to no start-up cost to a script.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import shutil
+import hashlib
+import builtins
+import threading
+import subprocess
+
+# Extra path prefixes the tracer ignores, joined with os.pathsep
+EXCLUDE_ENV_VAR = 'MATIMAGE_MEMO_EXCLUDE'
+
+MEMO_CONFIG = {
+    'dir': '.memo_cache',
+    'python': 'python',
+    'packages': ['numpy', 'scipy', 'opencv-python', 'opencv-python-headless', 'pillow', 'matplotlib',
+                 'scikit-image', 'pandas', 'python-docx', 'tifffile']
+}
+
+FINGERPRINT_CODE = (
+    "import sys, json, platform\n"
+    "from importlib import metadata\n"
+    "versions = {}\n"
+    "for name in sys.argv[1:]:\n"
+    "    try:\n"
+    "        versions[name] = metadata.version(name)\n"
+    "    except metadata.PackageNotFoundError:\n"
+    "        pass\n"
+    "print(json.dumps([sys.executable, sys.version, platform.platform(), versions]))\n"
+)
+
+
+def content_hash(path):
+    """sha1 of a file's bytes or of a directory's sorted listing; None if the path is gone"""
+    digest = hashlib.sha1()
+    try:
+        if os.path.isdir(path):
+            digest.update('\n'.join(sorted(os.listdir(path))).encode('utf-8'))
+        else:
+            with open(path, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    digest.update(block)
+    except OSError:
+        return None
+    return digest.hexdigest()
+
+
+def portable_path(path):
+    """Path relative to the working directory when inside it, absolute otherwise"""
+    path = os.path.abspath(path)
+    rel = os.path.relpath(path)
+    return path if rel.startswith(os.pardir) else rel
+
+
+class MemoStore:
+    """Make-style memo of successful script runs
+
+    Runs are indexed by (script hash, arguments, interpreter fingerprint); each
+    entry lists the input hashes it depended on, its stdout and its output
+    files, stored once by content under blobs/. A run's completion manifest is
+    not stored as an output; the entry keeps the files it listed instead, so
+    the manifest can be rebuilt for wherever the outputs are restored.
+    """
+
+    def __init__(self, memo_dir=None, python=None):
+        self.dir = os.path.abspath(memo_dir or MEMO_CONFIG['dir'])
+        self.python = python or MEMO_CONFIG['python']
+        self.lock = threading.Lock()
+        self._fingerprint = None
+
+    def fingerprint(self):
+        """Interpreter, platform and package versions of the Python that runs the scripts"""
+        with self.lock:
+            if self._fingerprint is None:
+                result = subprocess.run([self.python, '-c', FINGERPRINT_CODE, *MEMO_CONFIG['packages']],
+                                        capture_output=True, text=True)
+                self._fingerprint = result.stdout.strip() or result.stderr
+        return self._fingerprint
+
+    def key(self, filename, args):
+        parts = [content_hash(filename), list(args), self.fingerprint()]
+        return hashlib.sha1(json.dumps(parts).encode('utf-8')).hexdigest()
+
+    def _index_path(self, key):
+        return os.path.join(self.dir, 'index', f"{key}.json")
+
+    def _entries(self, key):
+        path = self._index_path(key)
+        if not os.path.exists(path):
+            return []
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+
+    def command(self, filename, args, exclude=()):
+        """Command and environment to run a script under the tracer; returns the trace path too"""
+        trace_path = os.path.join(self.dir, 'traces', f"{uuid.uuid4().hex}.json")
+        os.makedirs(os.path.dirname(trace_path), exist_ok=True)
+        env = {EXCLUDE_ENV_VAR: os.pathsep.join([self.dir, *exclude])}
+        return [self.python, os.path.abspath(__file__), trace_path, filename, *args], env, trace_path
+
+    def lookup(self, key):
+        """Recorded run whose inputs all still hash the same, after restoring its outputs, or None"""
+        for entry in self._entries(key):
+            if 'completed' not in entry:
+                # Recorded before manifests were rebuilt on restore
+                continue
+            if all(content_hash(path) == h for path, h in entry['inputs'].items()):
+                for path, h in entry['outputs'].items():
+                    if content_hash(path) != h:
+                        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+                        tmp = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+                        shutil.copyfile(os.path.join(self.dir, 'blobs', h), tmp)
+                        os.replace(tmp, path)
+                    else:
+                        os.utime(path)
+                return entry
+        return None
+
+    def record(self, key, trace_path, stdout, manifest_path=None):
+        """Store the outputs of a successful traced run under its key"""
+        with open(trace_path, encoding='utf-8') as f:
+            trace = json.load(f)
+        os.remove(trace_path)
+
+        completed = None
+        if manifest_path and os.path.exists(manifest_path):
+            base = os.path.dirname(os.path.abspath(manifest_path))
+            with open(manifest_path, encoding='utf-8') as f:
+                completed = [portable_path(os.path.join(base, e['path'])) for e in json.load(f)['files']]
+
+        outputs = {}
+        os.makedirs(os.path.join(self.dir, 'blobs'), exist_ok=True)
+        for path in trace['writes']:
+            if manifest_path and os.path.abspath(path) == os.path.abspath(manifest_path):
+                continue
+            h = content_hash(path)
+            if h is None or os.path.isdir(path):
+                continue
+            blob = os.path.join(self.dir, 'blobs', h)
+            if not os.path.exists(blob):
+                tmp = f"{blob}.{uuid.uuid4().hex[:8]}.tmp"
+                shutil.copyfile(path, tmp)
+                os.replace(tmp, blob)
+            outputs[path] = h
+
+        entry = {'inputs': trace['reads'], 'outputs': outputs, 'completed': completed, 'stdout': stdout,
+                 'time': time.time()}
+        with self.lock:
+            entries = [e for e in self._entries(key) if e['inputs'] != entry['inputs']] + [entry]
+            path = self._index_path(key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(entries, f, indent=1)
+            os.replace(tmp, path)
+
+
+class Tracer:
+    """Audit-hook record of the files a script reads, lists and writes"""
+
+    def __init__(self, script, exclude=()):
+        self.script = os.path.abspath(script)
+        cwd = os.path.abspath(os.curdir) + os.sep
+        # Never exclude the working directory itself, e.g. a mission run inside the temp dir
+        self.exclude = tuple(p for p in (os.path.abspath(p) + os.sep for p in exclude if p) if not cwd.startswith(p))
+        self.reads, self.writes = {}, []
+        self.local = threading.local()
+
+    def _tracked(self, path):
+        if isinstance(path, int):
+            return None
+        path = os.path.abspath(os.fsdecode(path))
+        if path == self.script or path.startswith(self.exclude) or '__pycache__' in path.split(os.sep):
+            return None
+        return path
+
+    def read(self, path):
+        path = self._tracked(path)
+        if path and portable_path(path) not in self.reads and path not in self.writes:
+            self.local.busy = True
+            try:
+                self.reads[portable_path(path)] = content_hash(path)
+            finally:
+                self.local.busy = False
+
+    def write(self, path):
+        path = self._tracked(path)
+        if path and path not in self.writes:
+            self.writes.append(path)
+
+    def discard(self, path):
+        path = self._tracked(path)
+        if path in self.writes:
+            self.writes.remove(path)
+
+    def hook(self, event, args):
+        if getattr(self.local, 'busy', False):
+            return
+        if event == 'open':
+            path, mode, flags = args
+            if mode is None:
+                writing = flags & (os.O_WRONLY | os.O_RDWR | os.O_CREAT)
+            else:
+                writing = any(c in mode for c in 'wax+')
+            if writing:
+                self.write(path)
+            else:
+                self.read(path)
+        elif event in ('os.listdir', 'os.scandir'):
+            # The import system lists every sys.path directory; only listings by the script count
+            if sys._getframe(1).f_code.co_filename.startswith('<frozen importlib'):
+                return
+            self.read(os.curdir if args[0] is None else args[0])
+        elif event == 'os.rename':
+            self.discard(args[0])
+            self.write(args[1])
+        elif event == 'os.remove':
+            self.discard(args[0])
+
+    def patch_cv2(self):
+        """OpenCV reads and writes images in C; wrap its file functions once it is imported"""
+        cv2 = sys.modules.get('cv2')
+        if cv2 is None or getattr(cv2, '_memo_traced', False):
+            return
+
+        def wrap(func, record):
+            def traced(filename, *args, **kwargs):
+                record(filename)
+                return func(filename, *args, **kwargs)
+            return traced
+
+        for name, record in (('imread', self.read), ('imreadmulti', self.read), ('imwrite', self.write)):
+            if hasattr(cv2, name):
+                setattr(cv2, name, wrap(getattr(cv2, name), record))
+        cv2._memo_traced = True
+
+    def install(self):
+        sys.addaudithook(self.hook)
+        original_import = builtins.__import__
+
+        def traced_import(name, *args, **kwargs):
+            module = original_import(name, *args, **kwargs)
+            if name.split('.')[0] == 'cv2':
+                self.patch_cv2()
+            return module
+        builtins.__import__ = traced_import
+
+    def dump(self, trace_path):
+        self.local.busy = True
+        writes = [portable_path(p) for p in self.writes if os.path.exists(p)]
+        reads = {p: h for p, h in self.reads.items() if p not in writes}
+        with open(trace_path, 'w', encoding='utf-8') as f:
+            json.dump({'reads': reads, 'writes': writes}, f, indent=1)
+
+
+def run_script(script, argv):
+    """Run a script as __main__ with argv as sys.argv, the way 'python script' would; returns its exit code"""
+    import runpy
+    import traceback
+
+    sys.argv = list(argv)
+    sys.path[0] = os.path.dirname(os.path.abspath(script))
+    try:
+        runpy.run_path(script, run_name='__main__')
+    except SystemExit as e:
+        return e.code
+    except BaseException as e:
+        # Report the error from the script's own frames, as a plain run would
+        tb = e.__traceback__
+        while tb is not None and os.path.abspath(tb.tb_frame.f_code.co_filename) != os.path.abspath(script):
+            tb = tb.tb_next
+        traceback.print_exception(type(e), e, tb or e.__traceback__)
+        return 1
+    return 0
+
+
+def main():
+    import tempfile
+
+    trace_path, script = sys.argv[1], sys.argv[2]
+    exclude = [sys.prefix, sys.base_prefix, sys.exec_prefix, os.path.dirname(os.path.abspath(__file__)),
+               os.path.expanduser('~/.cache'), os.path.expanduser('~/.config'), os.path.expanduser('~/.matplotlib'),
+               tempfile.gettempdir(), '/proc', '/dev', '/sys', *os.environ.get(EXCLUDE_ENV_VAR, '').split(os.pathsep)]
+    tracer = Tracer(script, exclude)
+    tracer.install()
+    try:
+        code = run_script(script, sys.argv[2:])
+    finally:
+        tracer.dump(trace_path)
+    sys.exit(code)
+
+
+if __name__ == '__main__':
+    main()
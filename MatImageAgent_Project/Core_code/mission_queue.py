@@ -0,0 +1,141 @@
+import time
+import sqlite3
+from contextlib import contextmanager
+
+QUEUE_CONFIG = {
+    'db': 'missions.db',
+    'max_attempts': 3,
+    'retry_delay': 30,
+    'latency_window': 200
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS missions (
+    id TEXT PRIMARY KEY,
+    user TEXT NOT NULL,
+    priority INTEGER NOT NULL DEFAULT 0,
+    md TEXT NOT NULL,
+    plan_mode INTEGER NOT NULL DEFAULT 0,
+    workdir TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    submitted REAL NOT NULL,
+    not_before REAL NOT NULL,
+    started REAL,
+    finished REAL,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS missions_status ON missions (status, priority, submitted);
+"""
+
+FIELDS = ['id', 'user', 'priority', 'plan_mode', 'workdir', 'status', 'attempts', 'submitted', 'started',
+          'finished', 'error']
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q / 100 * len(values)))] if values else None
+
+
+class MissionQueue:
+    """Durable SQLite mission queue with priorities, per-user fairness and retries
+
+    The next mission is the highest-priority one ready to run; among equal
+    priorities the user with the fewest running missions goes first, then the
+    oldest submission. A mission whose attempt raised is re-queued with
+    exponential back-off until max_attempts. Missions left 'running' by a
+    crashed daemon are re-queued on start.
+    """
+
+    def __init__(self, path=None, max_attempts=None, retry_delay=None):
+        self.path = path or QUEUE_CONFIG['db']
+        self.max_attempts = max_attempts or QUEUE_CONFIG['max_attempts']
+        self.retry_delay = QUEUE_CONFIG['retry_delay'] if retry_delay is None else retry_delay
+        with self.connect() as db:
+            db.executescript(SCHEMA)
+            db.execute("UPDATE missions SET status = 'queued' WHERE status = 'running'")
+
+    @contextmanager
+    def connect(self):
+        """Connection committed on success and always closed"""
+        db = sqlite3.connect(self.path, timeout=30)
+        db.row_factory = sqlite3.Row
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def submit(self, mission_id, md, workdir, user='anonymous', priority=0, plan_mode=False):
+        now = time.time()
+        with self.connect() as db:
+            db.execute("INSERT INTO missions (id, user, priority, md, plan_mode, workdir, submitted, not_before) "
+                       "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                       (mission_id, user, int(priority), md, int(plan_mode), workdir, now, now))
+        return mission_id
+
+    def claim(self):
+        """Mark the next mission as running and return it (with its MD), or None if none is ready"""
+        with self.connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            row = db.execute(
+                "SELECT m.* FROM missions m WHERE m.status = 'queued' AND m.not_before <= ? "
+                "ORDER BY m.priority DESC, "
+                "(SELECT COUNT(*) FROM missions r WHERE r.user = m.user AND r.status = 'running'), "
+                "m.submitted LIMIT 1", (time.time(),)).fetchone()
+            if row is not None:
+                db.execute("UPDATE missions SET status = 'running', started = ?, attempts = attempts + 1 "
+                           "WHERE id = ?", (time.time(), row['id']))
+        return dict(row, attempts=row['attempts'] + 1) if row is not None else None
+
+    def finish(self, mission_id, error=None):
+        """Record the end of an attempt; a failed attempt is retried later while attempts remain"""
+        now = time.time()
+        with self.connect() as db:
+            attempts = db.execute("SELECT attempts FROM missions WHERE id = ?", (mission_id,)).fetchone()[0]
+            if error is not None and attempts < self.max_attempts:
+                db.execute("UPDATE missions SET status = 'queued', not_before = ?, error = ? WHERE id = ?",
+                           (now + self.retry_delay * 2 ** (attempts - 1), error, mission_id))
+            else:
+                db.execute("UPDATE missions SET status = ?, finished = ?, error = ? WHERE id = ?",
+                           ('failed' if error is not None else 'finished', now, error, mission_id))
+
+    def release(self, mission_id):
+        """Return a claimed mission to the queue without counting the attempt"""
+        with self.connect() as db:
+            db.execute("UPDATE missions SET status = 'queued', attempts = attempts - 1 "
+                       "WHERE id = ? AND status = 'running'", (mission_id,))
+
+    def get(self, mission_id):
+        with self.connect() as db:
+            row = db.execute(f"SELECT {', '.join(FIELDS)} FROM missions WHERE id = ?", (mission_id,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def list(self, status=None):
+        query = f"SELECT {', '.join(FIELDS)} FROM missions"
+        with self.connect() as db:
+            if status:
+                rows = db.execute(query + " WHERE status = ? ORDER BY submitted", (status,)).fetchall()
+            else:
+                rows = db.execute(query + " ORDER BY submitted").fetchall()
+        return [dict(row) for row in rows]
+
+    def metrics(self):
+        """Queue depth by status and user, and wait/run latency percentiles of recent missions"""
+        with self.connect() as db:
+            depth = dict(db.execute("SELECT status, COUNT(*) FROM missions GROUP BY status").fetchall())
+            users = {}
+            for user, status, n in db.execute("SELECT user, status, COUNT(*) FROM missions "
+                                              "WHERE status IN ('queued', 'running') GROUP BY user, status"):
+                users.setdefault(user, {})[status] = n
+            recent = db.execute("SELECT submitted, started, finished FROM missions WHERE finished IS NOT NULL "
+                                "ORDER BY finished DESC LIMIT ?", (QUEUE_CONFIG['latency_window'],)).fetchall()
+        waits = [r['started'] - r['submitted'] for r in recent if r['started']]
+        runs = [r['finished'] - r['started'] for r in recent if r['started']]
+        return {
+            'depth': depth,
+            'users': users,
+            'wait_s': {'p50': percentile(waits, 50), 'p95': percentile(waits, 95)},
+            'run_s': {'p50': percentile(runs, 50), 'p95': percentile(runs, 95)},
+            'completed': len(recent)
+        }
@@ -0,0 +1,151 @@
+import os
+import cv2
+import numpy as np
+from PIL import Image
+from functools import partial
+
+import gap_engine
+import figures
+import image_io
+from artefacts import ArtefactWriter
+
+PIPELINE_CONFIG = {
+    'clip_limit': 3,
+    'tile_grid': (10, 10),
+    'low': 1,
+    'high': 150,
+    'k': 25,
+    're': 1.0,
+    'side_workers': 2
+}
+
+
+class Stage:
+    """A named pipeline step that reads and extends the per-image state dict
+
+    func(state, params) returns the value stored under key. If suffix is set,
+    the value can also be written as a side output named {image_name}{suffix}
+    by writer(value, path).
+    """
+
+    def __init__(self, name, func, key, suffix=None, writer=None):
+        self.name = name
+        self.func = func
+        self.key = key
+        self.suffix = suffix
+        self.writer = writer or write_image
+
+    def __call__(self, state, params):
+        state[self.key] = self.func(state, params)
+        return state
+
+
+def write_image(array, path):
+    """Encode an array with OpenCV"""
+    if not cv2.imwrite(path, array):
+        raise IOError(f"Failed to write image: {path}")
+    return path
+
+
+def decode_gray(state, params):
+    """Decode the input image straight to grayscale through the shared image cache"""
+    return image_io.read_gray(state['path'])
+
+
+_lab_luts = None
+
+
+def lab_luts():
+    """Lookup tables gray -> LAB L and L -> gray for gray pixels, as the T3 programs' round trip computes them
+
+    Those programs convert BGR to LAB, run CLAHE on L, convert back and read the
+    result with PIL's convert("L"). A gray pixel has a = b = 128, so both
+    directions are exact 256-entry tables.
+    """
+    global _lab_luts
+    if _lab_luts is None:
+        ramp = np.arange(256, dtype=np.uint8)
+        to_l = cv2.cvtColor(np.repeat(ramp[:, None, None], 3, axis=2), cv2.COLOR_BGR2LAB)[:, 0, 0]
+        lab = np.stack([ramp, np.full(256, 128, np.uint8), np.full(256, 128, np.uint8)], axis=-1)[:, None]
+        rgb = cv2.cvtColor(lab, cv2.COLOR_LAB2RGB)
+        from_l = np.asarray(Image.fromarray(rgb).convert('L'))[:, 0]
+        _lab_luts = (to_l, from_l)
+    return _lab_luts
+
+
+def clahe(state, params):
+    """CLAHE on the LAB L channel of the grayscale array, via lookup tables instead of colour conversions"""
+    to_l, from_l = lab_luts()
+    enhancer = cv2.createCLAHE(clipLimit=params['clip_limit'], tileGridSize=tuple(params['tile_grid']))
+    return from_l[enhancer.apply(to_l[state['gray']])]
+
+
+def detect_gap(state, params):
+    """GAP mask of the enhanced image"""
+    return gap_engine.gap_mask(state['enhanced'], params['low'], params['high'], params['k'])
+
+
+def region_stats(state, params):
+    """Per-component GAP statistics"""
+    return gap_engine.region_table(state['enhanced'], state['gap'], params['re'])
+
+
+def gap_overview(state, params):
+    """GAP mask handed to the page-width overview figure writer"""
+    return state['gap']
+
+
+class Pipeline:
+    """Run stages on decoded arrays in memory; side outputs go through a write-behind ArtefactWriter"""
+
+    def __init__(self, stages, output_dir, save=(), **params):
+        self.stages = stages
+        self.output_dir = output_dir
+        self.save = set(save)
+        self.params = dict(PIPELINE_CONFIG, **params)
+        self.artefacts = ArtefactWriter(output_dir, workers=self.params['side_workers'])
+
+    def run(self, path):
+        """Process one image and return its state dict"""
+        name = os.path.splitext(os.path.basename(path))[0]
+        state = {'path': path, 'name': name}
+        for stage in self.stages:
+            stage(state, self.params)
+            if stage.suffix and stage.name in self.save:
+                self.artefacts.submit(name + stage.suffix, partial(stage.writer, state[stage.key]))
+        return state
+
+    def run_all(self, paths):
+        """Process images in order, yielding each state as soon as it is ready"""
+        for path in paths:
+            yield self.run(path)
+
+    def flush(self):
+        """Wait for side outputs and return their manifest entries"""
+        return self.artefacts.flush()
+
+    def close(self):
+        return self.artefacts.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def t3_stages():
+    """Decode -> CLAHE -> GAP detection (written as a 1-bit mask) -> region statistics (written as CSV)"""
+    return [
+        Stage('decode', decode_gray, 'gray'),
+        Stage('clahe', clahe, 'enhanced', '_clahe.png'),
+        Stage('gap', detect_gap, 'gap', '_gap.png', image_io.save_mask),
+        Stage('regions', region_stats, 'regions', '_regions.csv', gap_engine.save_region_table),
+        Stage('overview', gap_overview, 'overview', '_gap_overview.png', figures.gap_overview)
+    ]
+
+
+def t3_pipeline(output_dir, save_enhanced=False, save_overview=False, **params):
+    """MD_T3 pipeline; the enhanced PNG and the report overview figure are opt-in"""
+    save = {'gap', 'regions'} | ({'clahe'} if save_enhanced else set()) | ({'overview'} if save_overview else set())
+    return Pipeline(t3_stages(), output_dir, save=save, **params)
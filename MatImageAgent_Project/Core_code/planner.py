@@ -0,0 +1,100 @@
+import re
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+PLAN_CONFIG = {
+    'workers': 4
+}
+
+# Explicit references to earlier steps: "step 2", "steps 2 and 3", "the previous step/program/output"
+STEP_REFERENCE = r'\bsteps?\s+(\d+(?:\s*(?:,|and|&|-|to)\s*\d+)*)'
+PREVIOUS_REFERENCE = r'\b(?:previous|preceding|above)\s+(?:steps?|programs?|outputs?|results?)\b'
+
+
+class Node:
+    """One subtask of a mission: kind is 'program', 'verify', 'draft' or 'report'"""
+
+    def __init__(self, node_id, kind, text, deps=()):
+        self.id = node_id
+        self.kind = kind
+        self.text = text
+        self.deps = list(deps)
+
+    def __repr__(self):
+        return f"Node({self.id!r}, {self.kind!r}, deps={self.deps})"
+
+
+def parse_steps(md):
+    """Numbered steps ('1.' or '(1)' at the start of a line) before the first [Section]"""
+    body = re.split(r'\n\s*\[', md, maxsplit=1)[0]
+    parts = re.split(r'(?m)^\s*(?:\((\d+)\)|(\d+)\.)\s+', body)
+    steps = []
+    for i in range(1, len(parts) - 2, 3):
+        steps.append((int(parts[i] or parts[i + 1]), parts[i + 2].strip()))
+    return steps or [(1, md.strip())]
+
+
+def referenced_steps(text):
+    """Step numbers named in a step's text ("step 2", "steps 2 and 3", "steps 1-3")"""
+    numbers = []
+    for group in re.findall(STEP_REFERENCE, text, re.IGNORECASE):
+        bounds = [int(n) for n in re.findall(r'\d+', group)]
+        if re.search(r'-|\bto\b', group) and len(bounds) == 2:
+            bounds = list(range(bounds[0], bounds[1] + 1))
+        numbers += bounds
+    return numbers
+
+
+def build_plan(md, auto_verify=True, report_engine=True):
+    """Dependency graph of the MD's steps; report prose is drafted in parallel with processing
+
+    A step depends on an earlier one only through an explicit link: it names
+    a pyN.py saved there, names the step ("step 2"), or refers to the previous
+    step, program or output. Generic words such as "then" or "output" appear in
+    almost every step and are not taken as links. Work inside one step (e.g.
+    per image) is not split: it lives in a single generated program.
+    """
+    nodes = {}
+    saved_by = {}
+    previous = None
+    for number, text in parse_steps(md):
+        node_id = f"step{number}"
+        scripts = [int(n) for n in re.findall(r'\bpy(\d+)\.py\b', text)]
+        deps = [saved_by[n] for n in scripts if n in saved_by]
+        deps += [f"step{n}" for n in referenced_steps(text) if f"step{n}" in nodes]
+        if previous and re.search(PREVIOUS_REFERENCE, text, re.IGNORECASE):
+            deps.append(previous)
+        deps = list(dict.fromkeys(deps))
+
+        if report_engine and re.search(r'Word document', text, re.IGNORECASE):
+            nodes['draft'] = Node('draft', 'draft', text)
+            nodes[node_id] = Node(node_id, 'report', text, [n for n in nodes if n != node_id])
+        elif auto_verify and re.search(r'\bverify\b', text, re.IGNORECASE) and re.search(r'\brun\b', text, re.IGNORECASE):
+            nodes[node_id] = Node(node_id, 'verify', text, deps)
+        else:
+            nodes[node_id] = Node(node_id, 'program', text, deps)
+            for n in re.findall(r'save it as py(\d+)\.py', text):
+                saved_by[int(n)] = node_id
+        previous = node_id
+    return nodes
+
+
+def run_plan(nodes, run_node, workers=None):
+    """Run every node as soon as its dependencies have finished
+
+    run_node(node, dep_results) returns the node's result; results of all
+    nodes are returned by id. The first failure cancels nodes not yet started.
+    """
+    results, running = {}, {}
+    with ThreadPoolExecutor(max_workers=workers or PLAN_CONFIG['workers']) as pool:
+        while len(results) < len(nodes):
+            for node in nodes.values():
+                if node.id not in results and node.id not in running and all(d in results for d in node.deps):
+                    running[node.id] = pool.submit(run_node, node, {d: results[d] for d in node.deps})
+            if not running:
+                raise ValueError(f"Plan has unsatisfiable dependencies: {nodes}")
+            done, _ = wait(running.values(), return_when=FIRST_COMPLETED)
+            for node_id, future in list(running.items()):
+                if future in done:
+                    del running[node_id]
+                    results[node_id] = future.result()
+    return results
@@ -0,0 +1,79 @@
+import os
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+import runtime
+
+PLOT_CONFIG = {
+    'figsize': (10, 6),
+    'dpi': 100,
+    'format': 'png',
+    'max_points': 4000
+}
+
+# Compressed TIFF instead of matplotlib's uncompressed default
+SAVE_OPTIONS = {
+    'tiff': {'pil_kwargs': {'compression': 'tiff_lzw'}},
+    'tif': {'pil_kwargs': {'compression': 'tiff_lzw'}},
+    'png': {}
+}
+
+
+def decimate(x, y, max_points=None):
+    """Min/max decimation for display; keeps every peak and trough of long profiles"""
+    max_points = max_points or PLOT_CONFIG['max_points']
+    x, y = np.asarray(x), np.asarray(y)
+    if y.size <= max_points:
+        return x, y
+    buckets = max_points // 2
+    edges = np.linspace(0, y.size, buckets + 1).astype(np.intp)
+    lo = np.minimum.reduceat(y, edges[:-1])
+    hi = np.maximum.reduceat(y, edges[:-1])
+    xs = np.repeat(x[edges[:-1]], 2)
+    ys = np.column_stack((lo, hi)).ravel()
+    return xs, ys
+
+
+class ProfilePlotter:
+    """Reusable Agg figure/axes template for profile plots such as u_eq vs distance"""
+
+    def __init__(self, figsize=None):
+        self.figure = Figure(figsize=figsize or PLOT_CONFIG['figsize'])
+        FigureCanvasAgg(self.figure)
+        self.axes = self.figure.add_subplot()
+        self.axes.grid(True)
+        self.line, = self.axes.plot([], [], 'b-', linewidth=2)
+
+    def render(self, x, y, path, title='', xlabel='Distance (μm)', ylabel='u_eq',
+               fmt=None, dpi=None):
+        """Draw one profile into the template and save it"""
+        fmt = fmt or os.path.splitext(path)[1].lstrip('.').lower() or PLOT_CONFIG['format']
+        self.line.set_data(*decimate(x, y))
+        self.axes.relim()
+        self.axes.autoscale_view()
+        self.axes.set_title(title)
+        self.axes.set_xlabel(xlabel)
+        self.axes.set_ylabel(ylabel)
+        self.figure.savefig(path, format=fmt, dpi=dpi or PLOT_CONFIG['dpi'], **SAVE_OPTIONS.get(fmt, {}))
+        return path
+
+
+_plotter = None
+
+
+def render_profile(job):
+    """Render one job dict (x, y, path and optional labels) with this process's template"""
+    global _plotter
+    if _plotter is None:
+        _plotter = ProfilePlotter()
+    return _plotter.render(**job)
+
+
+def render_batch(jobs, workers=None):
+    """Render profile jobs in a process pool and return the written paths"""
+    jobs = list(jobs)
+    if len(jobs) <= 1 or workers == 1:
+        return [render_profile(job) for job in jobs]
+    with runtime.process_pool(workers or len(jobs)) as pool:
+        return list(pool.map(render_profile, jobs))
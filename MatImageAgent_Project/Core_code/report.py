@@ -0,0 +1,129 @@
+import os
+import re
+import json
+from docx import Document
+from docx.shared import Inches
+from docx.enum.text import WD_ALIGN_PARAGRAPH
+
+from artefacts import temp_path
+from figures import prepare_figures
+
+# Metrics manifest path handed to generated scripts by the agent
+METRICS_ENV_VAR = 'MATIMAGE_METRICS'
+
+REPORT_CONFIG = {
+    'metrics_file': 'metrics.json',
+    'sections': ['Abstract', 'Introduction', 'Methods', 'Results'],
+    'figure_width': 6.0
+}
+
+
+def metrics_path(path=None):
+    return path or os.environ.get(METRICS_ENV_VAR) or REPORT_CONFIG['metrics_file']
+
+
+def load_metrics(path=None):
+    """Metrics manifest: {'metrics': {name: value}, 'figures': [{'path', 'caption'}]}"""
+    path = metrics_path(path)
+    if not os.path.exists(path):
+        return {'metrics': {}, 'figures': []}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def record_metrics(metrics, figures=(), path=None):
+    """Merge named results and (figure path, caption) pairs into the metrics manifest"""
+    path = metrics_path(path)
+    manifest = load_metrics(path)
+    manifest['metrics'].update(metrics)
+    known = {f['path'] for f in manifest['figures']}
+    for figure, caption in figures:
+        figure = os.path.abspath(figure)
+        if figure not in known:
+            manifest['figures'].append({'path': figure, 'caption': caption})
+    tmp = temp_path(path)
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=1, ensure_ascii=False, default=float)
+    os.replace(tmp, path)
+    return path
+
+
+def relocate_figures(old_dir, new_dir, path=None):
+    """Point figures recorded under old_dir at the same files under new_dir (e.g. after a sandbox is adopted)"""
+    path = metrics_path(path)
+    manifest = load_metrics(path)
+    old_dir = os.path.abspath(old_dir) + os.sep
+    for figure in manifest['figures']:
+        if figure['path'].startswith(old_dir):
+            figure['path'] = os.path.join(os.path.abspath(new_dir), figure['path'][len(old_dir):])
+    tmp = temp_path(path)
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=1, ensure_ascii=False, default=float)
+    os.replace(tmp, path)
+    return path
+
+
+def parse_prose(str1, sections=None):
+    """Section prose from an LLM answer holding a JSON object (optionally in a ```json block)"""
+    sections = sections or REPORT_CONFIG['sections']
+    match = re.search(r'```(?:json)?\s*\n(.*?)```', str1, re.DOTALL | re.IGNORECASE)
+    text = match.group(1) if match else str1[str1.find('{'):str1.rfind('}') + 1]
+    try:
+        prose = json.loads(text)
+    except ValueError:
+        return None
+    if not isinstance(prose, dict) or not all(s in prose for s in sections):
+        return None
+    return prose
+
+
+def build_report(prose, output_path, manifest=None):
+    """Assemble the .docx: title, prose sections, a metrics table and numbered figures in Results"""
+    manifest = manifest or load_metrics()
+    doc = Document()
+    doc.add_heading(prose.get('title') or 'Image Analysis Report', 0)
+
+    for section in REPORT_CONFIG['sections']:
+        doc.add_heading(section, level=1)
+        for paragraph in str(prose[section]).split('\n\n'):
+            if paragraph.strip():
+                doc.add_paragraph(paragraph.strip())
+
+    metrics = manifest['metrics']
+    if metrics:
+        table = doc.add_table(rows=1, cols=2)
+        table.style = 'Table Grid'
+        table.rows[0].cells[0].text = 'Quantity'
+        table.rows[0].cells[1].text = 'Value'
+        for name, value in metrics.items():
+            cells = table.add_row().cells
+            cells[0].text = str(name)
+            cells[1].text = f"{value:.4g}" if isinstance(value, float) else str(value)
+
+    figures = [f for f in manifest['figures'] if os.path.exists(f['path'])]
+    derivatives = prepare_figures([f['path'] for f in figures])
+    for i, (figure, derivative) in enumerate(zip(figures, derivatives), 1):
+        doc.add_picture(derivative, width=Inches(REPORT_CONFIG['figure_width']))
+        doc.paragraphs[-1].alignment = WD_ALIGN_PARAGRAPH.CENTER
+        caption = doc.add_paragraph(f"Fig. {i}. {figure['caption']}")
+        caption.alignment = WD_ALIGN_PARAGRAPH.CENTER
+
+    tmp = temp_path(output_path)
+    doc.save(tmp)
+    os.replace(tmp, output_path)
+    return output_path
+
+
+def prose_request(manifest, code_str=None, sections=None):
+    """Prompt asking the LLM for report prose only (all sections unless given)
+
+    Without code_str the task description is expected earlier in the conversation.
+    """
+    sections = sections or REPORT_CONFIG['sections']
+    figures = '; '.join(f"Fig. {i}: {f['caption']}" for i, f in enumerate(manifest['figures'], 1))
+    return ("Write only the prose of the research report requested in the task description; "
+            "the agent assembles the Word document, metrics table and figures itself. Respond with a JSON "
+            "object in a ```json block with the keys 'title', " + ', '.join(f"'{s}'" for s in sections) +
+            ". Each value is plain text, paragraphs separated by blank lines. Use only the numbers given in "
+            "[Metrics] and refer to figures as 'Fig. n'. [Metrics]: " + json.dumps(manifest['metrics'], ensure_ascii=False, default=float) +
+            ". [Figures]: " + (figures or 'none') + "." + (" [Task Description]:" + code_str if code_str else ""))
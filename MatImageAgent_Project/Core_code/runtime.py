@@ -0,0 +1,68 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+# Thread pools of NumPy's BLAS/OpenMP backends, read when the library is loaded
+THREAD_ENV_VARS = [
+    'OMP_NUM_THREADS',
+    'OPENBLAS_NUM_THREADS',
+    'MKL_NUM_THREADS',
+    'NUMEXPR_NUM_THREADS',
+    'VECLIB_MAXIMUM_THREADS'
+]
+
+# Global core budget handed down from the agent to generated scripts
+BUDGET_ENV_VAR = 'MATIMAGE_CPU_BUDGET'
+
+
+class ThreadBudget:
+    """Split a core budget between worker processes and per-library threads"""
+
+    def __init__(self, total=None, processes=1):
+        total = total or os.environ.get(BUDGET_ENV_VAR) or os.cpu_count() or 1
+        self.total = max(1, int(total))
+        self.processes = max(1, min(int(processes), self.total))
+        self.threads = max(1, self.total // self.processes)
+
+    @classmethod
+    def for_jobs(cls, n_jobs, total=None):
+        """Prefer process-level parallelism for independent images"""
+        return cls(total, processes=max(1, n_jobs))
+
+    def env(self, base=None):
+        """Environment for a child process using self.threads threads per library"""
+        env = dict(os.environ if base is None else base)
+        for var in THREAD_ENV_VARS:
+            env[var] = str(self.threads)
+        env[BUDGET_ENV_VAR] = str(self.threads)
+        return env
+
+    def apply(self):
+        """Limit the current process to self.threads threads per library"""
+        apply_threads(self.threads)
+
+    def process_pool(self):
+        """Process pool whose workers each stay within their share of the budget"""
+        return ProcessPoolExecutor(max_workers=self.processes,
+                                   initializer=apply_threads, initargs=(self.threads,))
+
+
+def apply_threads(threads):
+    """Set thread limits for OpenCV and for BLAS/OpenMP libraries loaded after this call"""
+    for var in THREAD_ENV_VARS:
+        os.environ[var] = str(threads)
+    os.environ[BUDGET_ENV_VAR] = str(threads)
+    try:
+        import cv2
+        cv2.setNumThreads(threads)
+    except ImportError:
+        pass
+    try:
+        from threadpoolctl import threadpool_limits
+        threadpool_limits(threads)
+    except ImportError:
+        pass
+
+
+def process_pool(n_jobs, total=None):
+    """Process pool for n_jobs independent tasks within the inherited core budget"""
+    return ThreadBudget.for_jobs(n_jobs, total).process_pool()
@@ -0,0 +1,143 @@
+"""Copy-on-write guard for candidate programs running in a sandbox
+
+Run as a program, this module runs a candidate inside its sandbox directory:
+    python sandbox.py <script.py> [args...]
+The sandbox links large files and folders to the working directory instead of
+copying them. The first time the script writes to, truncates or creates
+something inside a linked entry, that entry is copied into the sandbox (a
+folder becomes a real folder of links to its children), so candidates never
+write through to the working directory or to each other. Output folders
+outside the working directory get private copies under OUTPUTS_DIR in the
+sandbox; writing to the shared folders themselves (listed in GUARD_ENV_VAR)
+is refused.
+"""
+import os
+import sys
+import shutil
+import builtins
+import threading
+
+from memo import run_script
+
+# Shared output folders a candidate may not write to, joined with os.pathsep
+GUARD_ENV_VAR = 'MATIMAGE_SANDBOX_GUARD'
+# Sandbox folder holding a candidate's private copies of the shared output folders
+OUTPUTS_DIR = '.outputs'
+
+
+class CopyOnWrite:
+    """Audit-hook guard that privatises linked entries of a sandbox before they are changed"""
+
+    def __init__(self, root=None, guarded=()):
+        self.root = os.path.abspath(root or os.curdir)
+        self.guarded = tuple(os.path.abspath(p) for p in guarded if p)
+        self.local = threading.local()
+
+    def check(self, path):
+        """Refuse a write to a shared output folder"""
+        if isinstance(path, int):
+            return
+        path = os.path.abspath(os.fsdecode(path))
+        for root in self.guarded:
+            if path == root or path.startswith(root + os.sep):
+                raise PermissionError(f"{path}: write outputs to the output path exactly as given in the task")
+
+    def _inside(self, path):
+        """Path below the sandbox root, lexically resolved (links are not followed), or None"""
+        if isinstance(path, int):
+            return None
+        path = os.path.abspath(os.fsdecode(path))
+        return path if path.startswith(self.root + os.sep) else None
+
+    def _unlink_dir(self, path):
+        """Replace a linked folder by a real folder of links to its children"""
+        target = os.path.realpath(path)
+        os.unlink(path)
+        os.mkdir(path)
+        for name in os.listdir(target):
+            os.symlink(os.path.join(target, name), os.path.join(path, name))
+
+    def privatise(self, path, keep_content=True, parents_only=False):
+        """Make path and the folders above it private to the sandbox"""
+        path = self._inside(path)
+        if path is None:
+            return
+        self.local.busy = True
+        try:
+            current = self.root
+            parts = os.path.relpath(path, self.root).split(os.sep)
+            for part in parts[:-1]:
+                current = os.path.join(current, part)
+                if os.path.islink(current) and os.path.isdir(current):
+                    self._unlink_dir(current)
+            if parents_only or not os.path.islink(path):
+                return
+            if os.path.isdir(path):
+                self._unlink_dir(path)
+            else:
+                target = os.path.realpath(path)
+                os.unlink(path)
+                if keep_content and os.path.exists(target):
+                    shutil.copy2(target, path)
+        finally:
+            self.local.busy = False
+
+    def hook(self, event, args):
+        if getattr(self.local, 'busy', False):
+            return
+        if event == 'open':
+            path, mode, flags = args
+            if mode is None:
+                writing = flags & (os.O_WRONLY | os.O_RDWR | os.O_CREAT)
+                truncating = flags & os.O_TRUNC
+            else:
+                writing = any(c in mode for c in 'wax+')
+                truncating = 'w' in mode
+            if writing:
+                self.check(path)
+                self.privatise(path, keep_content=not truncating)
+        elif event in ('os.rename', 'os.link', 'os.symlink'):
+            self.check(args[0])
+            self.check(args[1])
+            self.privatise(args[0], parents_only=True)
+            self.privatise(args[1], parents_only=True)
+        elif event in ('os.remove', 'os.rmdir', 'os.mkdir'):
+            self.check(args[0])
+            self.privatise(args[0], parents_only=True)
+        elif event in ('os.truncate', 'os.utime', 'os.chmod'):
+            self.check(args[0])
+            self.privatise(args[0])
+
+    def patch_cv2(self):
+        """OpenCV writes images in C, out of sight of the audit hook; wrap imwrite once it is imported"""
+        cv2 = sys.modules.get('cv2')
+        if cv2 is None or getattr(cv2, '_sandbox_guarded', False) or not hasattr(cv2, 'imwrite'):
+            return
+        imwrite = cv2.imwrite
+
+        def guarded(filename, *args, **kwargs):
+            self.check(filename)
+            self.privatise(filename, keep_content=False)
+            return imwrite(filename, *args, **kwargs)
+        cv2.imwrite = guarded
+        cv2._sandbox_guarded = True
+
+    def install(self):
+        sys.addaudithook(self.hook)
+        original_import = builtins.__import__
+
+        def guarded_import(name, *args, **kwargs):
+            module = original_import(name, *args, **kwargs)
+            if name.split('.')[0] == 'cv2':
+                self.patch_cv2()
+            return module
+        builtins.__import__ = guarded_import
+
+
+def main():
+    CopyOnWrite(guarded=os.environ.get(GUARD_ENV_VAR, '').split(os.pathsep)).install()
+    sys.exit(run_script(sys.argv[1], sys.argv[1:]))
+
+
+if __name__ == '__main__':
+    main()
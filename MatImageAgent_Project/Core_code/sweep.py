@@ -0,0 +1,106 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import gap_engine
+import image_io
+import line_profile
+import plotting
+from artefacts import ArtefactWriter
+
+SWEEP_CONFIG = {
+    'workers': 4
+}
+
+
+class ParameterSweep:
+    """Run resolution-independent extraction once and fan the dependent post-processing out
+
+    extract() returns the shared data (decoded image, samples, masks);
+    post(data, value) produces the result for one parameter value and runs in
+    parallel for all values.
+    """
+
+    def __init__(self, extract, post, workers=None):
+        self.extract = extract
+        self.post = post
+        self.workers = workers or SWEEP_CONFIG['workers']
+        self.data = None
+
+    def run(self, values):
+        """Return {value: post(data, value)}"""
+        if self.data is None:
+            self.data = self.extract()
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            results = list(pool.map(lambda v: self.post(self.data, v), values))
+        return dict(zip(values, results))
+
+
+def line_profile_sweep(image_path, start_point, end_point, resolutions, output_dir,
+                       u_min=None, u_max=None, workers=None, plot_format='png', dpi=None):
+    """MD_T2 outputs for several resolutions from one decode and one line sample
+
+    u_eq plots are rendered as one batch; pass plot_format='tiff', dpi=300 when
+    the MD asks for 300 dpi TIFF figures, or plot_format=None to skip them.
+    """
+    name = os.path.splitext(os.path.basename(image_path))[0]
+    writer = ArtefactWriter(output_dir)
+
+    def extract():
+        sample = line_profile.sample_line(image_io.read_gray(image_path), start_point, end_point, u_min, u_max)
+        writer.write_csv(f"{name}_grayscale_values.csv", enumerate(sample['gray'].tolist()),
+                         ['Position', 'Grayscale Value'])
+        return sample
+
+    def post(sample, resolution):
+        profile = line_profile.scale_profile(sample, resolution)
+        writer.write_text(f"{name}_line_length_res{resolution}.txt",
+                          f"Line segment length: {profile['length_um']} μm\n"
+                          f"Start point: {sample['start_point']}\n"
+                          f"End point: {sample['end_point']}\n"
+                          f"Resolution: {resolution} μm/pixel\n")
+        writer.write_csv(f"{name}_u_eq_values_res{resolution}.csv",
+                         zip(profile['distance_um'].tolist(), sample['u_eq'].tolist()),
+                         ['Distance (μm)', 'u_eq'])
+        return profile
+
+    sweep = ParameterSweep(extract, post, workers)
+    with writer:
+        results = sweep.run(resolutions)
+    if plot_format:
+        sample = sweep.data
+        plotting.render_batch([{
+            'x': results[res]['distance_um'],
+            'y': sample['u_eq'],
+            'path': os.path.join(output_dir, f"{name}_u_eq_plot_res{res}.{plot_format}"),
+            'title': f"u_eq vs Distance (resolution {res} μm/pixel)",
+            'dpi': dpi
+        } for res in resolutions], workers)
+    return results
+
+
+def gap_height_sweep(image_path, resolutions, output_dir, low=None, high=None, k=None, workers=None):
+    """MD_T1 height statistics for several resolutions from one GAP mask"""
+    name = os.path.splitext(os.path.basename(image_path))[0]
+    writer = ArtefactWriter(output_dir)
+
+    def extract():
+        mask = gap_engine.gap_mask(image_io.read_gray(image_path), low, high, k)
+        return gap_engine.column_statistics(mask, re=1.0)
+
+    def post(stats, re):
+        summary = {
+            'resolution': re,
+            'max_height': stats['max_height'] * re,
+            'avg_height': stats['avg_height'] * re,
+            'column_heights': stats['column_heights'] * re,
+            'void_heights': stats['void_heights'] * re
+        }
+        writer.write_text(f"{name}_gap_heights_re{re}.txt",
+                          f"Physical dimension: {re} μm/pixel\n"
+                          f"Max GAP height: {summary['max_height']:.4f} μm\n"
+                          f"Average GAP height: {summary['avg_height']:.4f} μm\n")
+        return summary
+
+    with writer:
+        results = ParameterSweep(extract, post, workers).run(resolutions)
+    return results
@@ -0,0 +1,162 @@
+import os
+import json
+import numpy as np
+
+import gap_engine
+import image_io
+import line_profile
+import pipeline
+import plotting
+import report
+from artefacts import ArtefactWriter
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.tif', '.tiff', '.bmp')
+
+
+def _schema(name, description, properties, required=()):
+    return {
+        'type': 'function',
+        'function': {
+            'name': name,
+            'description': description,
+            'parameters': {'type': 'object', 'properties': properties, 'required': list(required)}
+        }
+    }
+
+
+STR = {'type': 'string'}
+NUM = {'type': 'number'}
+INT = {'type': 'integer'}
+POINT = {'type': 'array', 'items': {'type': 'integer'}, 'minItems': 2, 'maxItems': 2}
+
+
+class ToolBox:
+    """Vetted image operations the LLM can call instead of writing programs
+
+    Arrays stay in memory under string handles (an image name, '<name>_clahe',
+    '<name>_gap', ...); tools take and return handles plus small JSON results.
+    """
+
+    def __init__(self, output_dir='.'):
+        self.output_dir = output_dir
+        self.arrays = {}
+        self.tables = {}
+        self.writer = ArtefactWriter(output_dir)
+        self.registry = {
+            'load_images': (self.load_images, _schema(
+                'load_images', 'Decode all images in a folder whose names start with prefix to grayscale.',
+                {'folder': STR, 'prefix': STR}, ['folder'])),
+            'clahe': (self.clahe, _schema(
+                'clahe', 'CLAHE enhancement of a loaded image; returns the handle of the enhanced image.',
+                {'image': STR, 'clip_limit': NUM, 'tile_grid': INT}, ['image'])),
+            'gap_mask': (self.gap_mask, _schema(
+                'gap_mask', 'GAP pixels: grayscale in [low, high] and 4-connected to at least k such pixels.',
+                {'image': STR, 'low': INT, 'high': INT, 'k': INT}, ['image', 'low', 'high', 'k'])),
+            'column_heights': (self.column_heights, _schema(
+                'column_heights', 'Per-column GAP height (max_row - min_row + 1) * re and max/avg height in um.',
+                {'mask': STR, 're': NUM}, ['mask', 're'])),
+            'region_table': (self.region_table, _schema(
+                'region_table', 'Per-component GAP statistics (area, bbox, centroid, size in um, mean gray).',
+                {'image': STR, 'mask': STR, 're': NUM}, ['image', 'mask'])),
+            'line_profile': (self.line_profile, _schema(
+                'line_profile', 'Grayscale values and u_eq = u_min + gray / 255 * u_max along a line; start and end are (x, y).',
+                {'image': STR, 'start_point': POINT, 'end_point': POINT, 'resolution': NUM,
+                 'u_min': NUM, 'u_max': NUM}, ['image', 'start_point', 'end_point', 'resolution'])),
+            'save_outputs': (self.save_outputs, _schema(
+                'save_outputs', 'Write a handle to a file: masks as 1-bit PNG, images as PNG, profiles and tables as CSV, '
+                'profiles as plots when filename ends with .png/.tiff.',
+                {'handle': STR, 'filename': STR, 'dpi': INT}, ['handle', 'filename'])),
+            'record_metrics': (self.record_metrics, _schema(
+                'record_metrics', 'Record named numeric results and figure captions for the report.',
+                {'metrics': {'type': 'object'}, 'figures': {'type': 'object', 'description': 'filename -> caption'}},
+                ['metrics'])),
+            'assemble_report': (self.assemble_report, _schema(
+                'assemble_report', 'Assemble the Word report from the recorded metrics and figures and the given prose.',
+                {'filename': STR, 'title': STR, 'Abstract': STR, 'Introduction': STR, 'Methods': STR, 'Results': STR},
+                ['filename', 'title', 'Abstract', 'Introduction', 'Methods', 'Results']))
+        }
+
+    def schemas(self):
+        return [schema for _, schema in self.registry.values()]
+
+    def call(self, name, arguments):
+        """Run one tool call and return its JSON result (errors are returned, not raised)"""
+        if name not in self.registry:
+            return json.dumps({'error': f"Unknown tool: {name}"})
+        try:
+            kwargs = json.loads(arguments or '{}')
+            return json.dumps(self.registry[name][0](**kwargs), default=float)
+        except Exception as e:
+            return json.dumps({'error': f"{type(e).__name__}: {e}"})
+
+    def _array(self, handle):
+        if handle not in self.arrays:
+            raise KeyError(f"No array named {handle}; known handles: {sorted(self.arrays)}")
+        return self.arrays[handle]
+
+    def load_images(self, folder, prefix=''):
+        loaded = {}
+        for name in sorted(os.listdir(folder)):
+            if name.startswith(prefix) and name.lower().endswith(IMAGE_EXTENSIONS):
+                handle = os.path.splitext(name)[0]
+                self.arrays[handle] = image_io.read_gray(os.path.join(folder, name))
+                loaded[handle] = list(self.arrays[handle].shape)
+        return {'images': loaded}
+
+    def clahe(self, image, clip_limit=3, tile_grid=10):
+        # Same LAB-L round trip as the T3 pipeline, so both give the same GAP results
+        handle = f"{image}_clahe"
+        self.arrays[handle] = pipeline.clahe({'gray': np.ascontiguousarray(self._array(image))},
+                                             {'clip_limit': clip_limit, 'tile_grid': (tile_grid, tile_grid)})
+        return {'handle': handle}
+
+    def gap_mask(self, image, low, high, k):
+        handle = f"{image}_gap"
+        self.arrays[handle] = gap_engine.gap_mask(self._array(image), low, high, k)
+        return {'handle': handle, 'gap_pixels': int(self.arrays[handle].sum()),
+                'total_pixels': int(self.arrays[handle].size)}
+
+    def column_heights(self, mask, re):
+        stats = gap_engine.column_statistics(self._array(mask), re)
+        self.tables[f"{mask}_columns"] = {'column': np.arange(stats['column_heights'].size),
+                                          'height_um': stats['column_heights']}
+        return {'table': f"{mask}_columns", 'max_height_um': stats['max_height'],
+                'avg_height_um': stats['avg_height'], 'voids': int(stats['void_heights'].size)}
+
+    def region_table(self, image, mask, re=1.0):
+        handle = f"{mask}_regions"
+        self.tables[handle] = gap_engine.region_table(self._array(image), self._array(mask), re)
+        return {'table': handle, 'components': int(self.tables[handle]['area'].size)}
+
+    def line_profile(self, image, start_point, end_point, resolution, u_min=None, u_max=None):
+        sample = line_profile.sample_line(self._array(image), start_point, end_point, u_min, u_max)
+        profile = line_profile.scale_profile(sample, resolution)
+        handle = f"{image}_profile"
+        self.tables[handle] = {'distance_um': profile['distance_um'], 'gray': sample['gray'],
+                               'u_eq': sample['u_eq']}
+        return {'table': handle, 'length_um': profile['length_um'], 'points': int(sample['gray'].size),
+                'u_eq_mean': float(sample['u_eq'].mean())}
+
+    def save_outputs(self, handle, filename, dpi=None):
+        ext = os.path.splitext(filename)[1].lower()
+        if handle in self.tables:
+            table = self.tables[handle]
+            if ext in ('.png', '.tif', '.tiff') and 'u_eq' in table:
+                path = os.path.join(self.output_dir, filename)
+                plotting.render_profile({'x': table['distance_um'], 'y': table['u_eq'], 'path': path, 'dpi': dpi})
+                return {'path': path}
+            columns = list(table)
+            self.writer.write_csv(filename, zip(*(np.asarray(table[c]).tolist() for c in columns)), columns)
+        elif self._array(handle).dtype == bool:
+            self.writer.save_mask(filename, self.arrays[handle])
+        else:
+            self.writer.save_image(filename, self.arrays[handle])
+        self.writer.flush()
+        return {'path': os.path.join(self.output_dir, filename)}
+
+    def record_metrics(self, metrics, figures=None):
+        figures = [(os.path.join(self.output_dir, f), c) for f, c in (figures or {}).items()]
+        return {'metrics_file': report.record_metrics(metrics, figures)}
+
+    def assemble_report(self, filename, **prose):
+        return {'path': report.build_report(prose, os.path.join(self.output_dir, filename))}